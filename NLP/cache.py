@@ -0,0 +1,193 @@
+"""
+Cache.py module contains an on-disk cache for the results of the NLP pipeline.
+
+Entries are keyed by a hash of the input corpus plus the pipeline parameters, so the same text analysed
+with the same settings is only processed once. The cache is bounded in size and evicts the least recently
+used entries first (file modification time is used as the last access time).
+
+Large results made of text lines (e.g. the phrases of a streamed upload) are kept as gzip compressed line files
+instead of pickles, so they are written and read back line by line.
+"""
+import os
+import gzip
+import pickle
+import secrets
+import hashlib
+from flaskblog import app
+from flaskblog.metrics import increment
+
+# bump this when the pipeline changes in a way that makes old entries wrong
+CACHE_VERSION = 4
+
+
+class AnalysisCache:
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(corpus, **params):
+        """
+        Function to build a cache key
+        Input: iterable of texts, pipeline parameters
+        Output: hex digest identifying the corpus and parameters
+        """
+        digest = hashlib.sha256()
+        digest.update('v{}'.format(CACHE_VERSION).encode('utf-8'))
+        for name in sorted(params):
+            digest.update('|{}={}'.format(name, params[name]).encode('utf-8'))
+        for text in corpus:
+            digest.update(b'\0')
+            digest.update(str(text).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get_path(self, key, name):
+        return os.path.join(self.cache_dir, '{}-{}.pkl'.format(name, key))
+
+    def get(self, key, name):
+        """
+        Function to get a cached value
+        Input: cache key, name of the stored result
+        Output: the value, None on a miss
+        """
+        path = self.get_path(key, name)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+        except OSError:
+            self.misses += 1
+            increment('nlp_analysis_cache_misses_total')
+            return None
+        except Exception:
+            # unreadable entry (truncated, or written by an incompatible version) - drop it
+            self.misses += 1
+            increment('nlp_analysis_cache_misses_total')
+            self.remove(path)
+            return None
+
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass  # evicted by another worker in the meantime, the value is still good
+        self.hits += 1
+        increment('nlp_analysis_cache_hits_total')
+        return value
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def replace_file(self, path, save):
+        """
+        Function to write an entry under a temporary name of its own and move it into place, so workers writing
+        the same key at the same time don't write into one file, and readers never see half of it
+        """
+        tmp_path = '{}.{}.tmp'.format(path, secrets.token_hex(4))
+        try:
+            save(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            self.remove(tmp_path)
+            raise
+        self.evict()
+
+    def put(self, key, name, value):
+        def save(tmp_path):
+            with open(tmp_path, 'wb') as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.replace_file(self.get_path(key, name), save)
+
+    def get_lines_path(self, key, name):
+        return os.path.join(self.cache_dir, '{}-{}.txt.gz'.format(name, key))
+
+    def put_lines(self, key, name, lines):
+        """
+        Function to cache an iterable of text lines, written one by one
+        """
+        def save(tmp_path):
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as file:
+                file.writelines(line + '\n' for line in lines)
+
+        self.replace_file(self.get_lines_path(key, name), save)
+
+    def iter_lines(self, key, name):
+        """
+        Function to read cached text lines
+        Output: generator of the lines, None on a miss
+        """
+        path = self.get_lines_path(key, name)
+        try:
+            file = gzip.open(path, 'rt', encoding='utf-8')
+        except OSError:
+            self.misses += 1
+            increment('nlp_analysis_cache_misses_total')
+            return None
+
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass  # the open file can still be read
+        self.hits += 1
+        increment('nlp_analysis_cache_hits_total')
+        return iter_file_lines(file)
+
+    def evict(self):
+        """
+        Function to remove least recently used entries until the cache fits in max_bytes
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(('.pkl', '.txt.gz')):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # removed by another worker
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # already evicted by another worker
+            total_bytes -= size
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
+
+
+def iter_file_lines(file):
+    with file:
+        for line in file:
+            yield line[:-1]
+
+
+def read_static_file(directory, filename):
+    with open(os.path.join(app.root_path, 'static', directory, filename), 'rb') as file:
+        return file.read()
+
+
+def restore_static_file(directory, filename, data):
+    """
+    Function to write a cached artifact back into static/ if it has been removed since it was cached
+    """
+    full_path = os.path.join(app.root_path, 'static', directory, filename)
+    if not os.path.exists(full_path):
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as file:
+            file.write(data)
+
+
+analysis_cache = AnalysisCache(os.path.join(app.root_path, 'cache'), app.config['ANALYSIS_CACHE_MAX_BYTES'])
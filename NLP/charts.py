@@ -0,0 +1,209 @@
+"""
+Charts.py module renders the hashtag and timeline charts of the twitter dashboard and the phrase wordclouds.
+
+Each chart is saved as a small JSON spec (labels, values, titles) named after the hash of its contents, so the
+same data is only ever rendered once. The image is rendered on a small thread pool as soon as the spec is saved
+and the /charts route serves it, rendering it on demand if the pool hasn't got to it yet (or if another worker
+saved the spec). The spec itself can be fetched as <name>.json to draw the chart client side.
+
+Wordclouds are drawn from the word counts the pipeline has already made (generate_from_frequencies), so their
+cost depends on the number of words shown, not on the length of the corpus.
+
+Charts are drawn on their own Figure objects with the Agg canvas instead of pyplot, so no figure is kept in
+pyplot's global registry and worker memory doesn't grow with every request.
+
+Layout: static/<kind>/<name>.json plus static/<kind>/<name>.png|.svg once rendered
+"""
+import os
+import re
+import json
+import hashlib
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from wordcloud import WordCloud
+from flaskblog import app
+
+WORDCLOUD_SIZE = (512, 512)
+WORDCLOUD_MAX_WORDS = 150
+
+CHART_FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml', 'json': 'application/json'}
+
+chart_name_pattern = re.compile(r'^[0-9a-f]{16}$')
+
+executor = None
+# path of the image being rendered -> future, so concurrent requests for one chart render it once
+pending_renders = {}
+lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Function to create the render pool on first use
+    One thread by default - matplotlib is not thread safe beyond separate figures on the Agg canvas
+    """
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=app.config['CHART_WORKERS'])
+    return executor
+
+
+def get_chart_path(kind, name, fmt):
+    return os.path.join(app.root_path, 'static', kind, '{}.{}'.format(name, fmt))
+
+
+def draw_barplot(figure, spec):
+    axes = figure.add_subplot()
+    axes.barh(spec['labels'], spec['values'], color='grey')
+    axes.set_xlabel(spec['xlabel'])
+    axes.set_ylabel(spec['ylabel'])
+    axes.set_title(spec['title'])
+
+
+def draw_lineplot(figure, spec):
+    axes = figure.add_subplot()
+    axes.plot(spec['labels'], spec['values'], color='darkblue')
+    axes.set_xlabel(spec['xlabel'])
+    axes.set_ylabel(spec['ylabel'])
+
+
+def render_figure(draw):
+    """
+    Function to get the renderer of a matplotlib chart
+    Input: function drawing the chart on a figure from its spec
+    """
+    def render(spec, path, fmt):
+        figure = Figure(figsize=spec['figsize'])
+        FigureCanvasAgg(figure)
+        draw(figure, spec)
+        figure.savefig(path, format=fmt)
+
+    return render
+
+
+def render_wordcloud(spec, path, fmt):
+    wordcloud = WordCloud(width=spec['width'], height=spec['height'], max_words=spec['max_words'],
+                          background_color='white').generate_from_frequencies(dict(spec['frequencies']))
+    if fmt == 'svg':
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(wordcloud.to_svg())
+    else:
+        wordcloud.to_image().save(path, format='PNG')
+
+
+# kind of chart (also its directory under static/) -> function saving the chart from its spec
+chart_kinds = {
+    'hashtags': render_figure(draw_barplot),
+    'twitter_timeline': render_figure(draw_lineplot),
+    'wordclouds': render_wordcloud,
+}
+
+
+def render_chart(kind, name, fmt):
+    """
+    Function to draw a chart from its spec and save the image
+    Input: kind of chart, name of the chart, image format (png or svg)
+    Output: path of the image
+    """
+    path = get_chart_path(kind, name, fmt)
+    if os.path.exists(path):
+        return path
+
+    with open(get_chart_path(kind, name, 'json')) as file:
+        spec = json.load(file)
+
+    tmp_path = '{}.{}.tmp'.format(path, secrets.token_hex(4))
+    chart_kinds[kind](spec, tmp_path, fmt)
+    os.replace(tmp_path, path)
+    return path
+
+
+def submit_render(kind, name, fmt):
+    """
+    Function to queue a chart on the render pool, unless it is already queued
+    Output: future of the image path
+    """
+    path = get_chart_path(kind, name, fmt)
+    with lock:
+        future = pending_renders.get(path)
+        if future is None:
+            future = pending_renders[path] = get_executor().submit(render_chart, kind, name, fmt)
+            future.add_done_callback(lambda done: pending_renders.pop(path, None))
+    return future
+
+
+def save_chart(kind, spec, fmt=None):
+    """
+    Function to save the spec of a chart and start rendering it in the background
+    Input: kind of chart, JSON serializable spec, image format (default app.config['CHART_FORMAT'])
+    Output: filename of the chart
+    """
+    data = json.dumps(spec, sort_keys=True).encode('utf-8')
+    name = hashlib.sha256(data).hexdigest()[:16]
+
+    spec_path = get_chart_path(kind, name, 'json')
+    if not os.path.exists(spec_path):
+        os.makedirs(os.path.dirname(spec_path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(spec_path, secrets.token_hex(4))
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, spec_path)
+
+    fmt = fmt or app.config['CHART_FORMAT']
+    submit_render(kind, name, fmt)
+    return '{}.{}'.format(name, fmt)
+
+
+def get_spec_filename(filename):
+    return '{}.json'.format(filename.partition('.')[0])
+
+
+def get_chart_file(kind, filename):
+    """
+    Function to get the file of a chart, waiting for (or starting) its render if needed
+    Input: kind of chart, filename as <name>.<png|svg|json>
+    Output: (path, mimetype), None if there is no such chart
+    """
+    name, _, fmt = filename.partition('.')
+    if kind not in chart_kinds or fmt not in CHART_FORMATS or not chart_name_pattern.match(name):
+        return None
+    if not os.path.exists(get_chart_path(kind, name, 'json')):
+        return None
+
+    path = get_chart_path(kind, name, fmt)
+    if not os.path.exists(path):
+        path = submit_render(kind, name, fmt).result(timeout=app.config['CHART_RENDER_TIMEOUT'])
+    return path, CHART_FORMATS[fmt]
+
+
+def save_barplot(df_data):
+    df_data = df_data.sort_values(by='count')
+    return save_chart('hashtags', {'figsize': [12, 9],
+                                   'labels': [str(label) for label in df_data['hashtags']],
+                                   'values': [int(value) for value in df_data['count']],
+                                   'xlabel': 'Total Count',
+                                   'ylabel': 'Hashtags',
+                                   'title': 'Top 20 hashtags'})
+
+
+def save_lineplot(df_data, xlabel='YYYY-MM'):
+    return save_chart('twitter_timeline', {'figsize': [20, 5],
+                                           'labels': [str(label) for label in df_data['period']],
+                                           'values': [int(value) for value in df_data['count']],
+                                           'xlabel': xlabel,
+                                           'ylabel': '# of Tweets'})
+
+
+def save_wordcloud(words_freq):
+    """
+    Function to save a wordcloud of the most frequent words
+    Input: list of (word, count), most frequent first
+    Output: filename of the wordcloud image
+    """
+    width, height = WORDCLOUD_SIZE
+    return save_chart('wordclouds', {'frequencies': [[word, int(count)] for word, count in words_freq],
+                                     'width': width,
+                                     'height': height,
+                                     'max_words': WORDCLOUD_MAX_WORDS}, fmt='png')
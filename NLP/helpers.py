@@ -6,6 +6,7 @@ import gensim
 from gensim import corpora, models
 import re
 import string
+from flaskblog.NLP.sentences import sentence_pattern
 
 
 def get_sentences(text):
@@ -15,7 +16,21 @@ def get_sentences(text):
     Output: List of sentences in the review
     """
     text = str(text)
-    return re.split(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!)\s', text)
+    return sentence_pattern.split(text)
+
+
+def iter_batches(items, batch_size):
+    """
+    Function to group an iterable into lists of at most batch_size items
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
 def get_stopwords():
@@ -0,0 +1,38 @@
+"""
+Loader.py module loads the NLP stack (spaCy, NLTK, gensim, pyLDAvis, wordcloud, matplotlib, ...) on first use
+instead of at import time, so web workers that only serve the blog routes start fast and stay small.
+
+Workers that serve the analysis routes can load everything up front with warm_up(), e.g. from gunicorn's
+post_worker_init hook or by starting the app with NLP_WARM_UP=1.
+"""
+import importlib
+
+# modules that pull in the NLP stack
+NLP_MODULES = ['flaskblog.NLP.process_text', 'flaskblog.NLP.twitter_data']
+
+
+def lazy_function(module_name, function_name):
+    """
+    Function to get a stand-in for a function which imports the function's module on the first call
+    Input: dotted module name, name of the function in that module
+    Output: callable with the same arguments as the function
+    """
+    def wrapper(*args, **kwargs):
+        function = getattr(importlib.import_module(module_name), function_name)
+        return function(*args, **kwargs)
+
+    wrapper.__name__ = function_name
+    wrapper.__qualname__ = function_name
+    return wrapper
+
+
+def warm_up():
+    """
+    Function to import the NLP modules and load the spaCy model and stop words ahead of the first request
+    """
+    for module_name in NLP_MODULES:
+        importlib.import_module(module_name)
+
+    nlp_utils = importlib.import_module('flaskblog.NLP.utils')
+    nlp_utils.get_nlp()
+    nlp_utils.get_stop_word_set()
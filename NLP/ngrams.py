@@ -0,0 +1,288 @@
+"""
+Ngrams.py module counts n-grams in a corpus and picks the most frequent ones.
+
+Counting is done in a single fit_transform and the top n are selected with a partial sort of the column sums.
+For very large vocabularies a hashing mode keeps memory bounded by a fixed number of buckets instead of a
+vocabulary dictionary. A TokenCorpus (see token_corpus.py) is counted on its token ids, without building a
+second vocabulary of strings; the counts of several parts of a corpus can be merged (merge_ngram_counts), which
+gives the same top n-grams as counting the whole corpus at once.
+
+Ties are always broken in alphabetical order of the n-grams. Hashing mode reads the corpus twice, so a
+single-pass iterator is first turned into a list.
+"""
+import re
+import numpy as np
+from collections import Counter
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+from sklearn.utils import murmurhash3_32
+
+# CountVectorizer's default token pattern
+token_pattern = re.compile(r'(?u)\b\w\w+\b')
+
+
+def top_n_indices(counts, n):
+    """
+    Function to get the indices of the n largest counts without sorting the whole array
+    Input: 1-d array of counts, number of indices to return
+    Output: indices ordered by count (highest first), ties ordered by index
+    """
+    if n <= 0:
+        return np.array([], dtype=np.intp)
+    if n < len(counts):
+        # everything counted more often than the n-th count, then the first of the ties
+        threshold = np.partition(counts, len(counts) - n)[len(counts) - n]
+        above = np.flatnonzero(counts > threshold)
+        indices = np.concatenate([above, np.flatnonzero(counts == threshold)[:n - len(above)]])
+    else:
+        indices = np.arange(len(counts))
+    return indices[np.lexsort((indices, -counts[indices]))]
+
+
+def get_bucket(term, n_features):
+    """
+    Function to get the HashingVectorizer column of a term (mirrors sklearn's feature hashing)
+    """
+    h = murmurhash3_32(term, seed=0, positive=False)
+    if h == -2147483648:
+        return (2147483647 - (n_features - 1)) % n_features
+    return abs(h) % n_features
+
+
+def count_ngrams(corpus, n=20, ngram_range=(2, 3), n_features=None):
+    """
+    Function to count n-grams and get the n most frequent ones
+    Input: corpus (list or Series of texts), number of n-grams to return, n-gram sizes,
+           number of hash buckets (None counts an exact vocabulary)
+    Output: list of (n-gram, count) for the top n n-grams, number of unique n-grams
+            (in hashing mode the number of non-empty buckets, a lower bound)
+    """
+    if n_features is not None:
+        return count_hashed_ngrams(corpus, n, ngram_range, n_features)
+
+    vec = CountVectorizer(ngram_range=ngram_range)
+    bag_of_words = vec.fit_transform(corpus)
+    sum_words = np.asarray(bag_of_words.sum(axis=0)).ravel()
+
+    top = top_n_indices(sum_words, n)
+    wanted = set(top.tolist())
+    terms = {idx: word for word, idx in vec.vocabulary_.items() if idx in wanted}
+    words_freq = [(terms[idx], int(sum_words[idx])) for idx in top]
+
+    return words_freq, len(vec.vocabulary_)
+
+
+def count_ngrams_and_words(corpus, n=20, n_words=150, ngram_range=(2, 3), n_features=None):
+    """
+    Function to get the top n-grams and the top single words of a corpus from a single count
+    Input: corpus, number of n-grams to return, number of words to return, n-gram sizes, number of hash buckets
+    Output: list of (n-gram, count) for the top n n-grams (same as count_ngrams), list of (word, count) for the
+            top n_words words
+    """
+    if n_features is not None:
+        if iter(corpus) is corpus:
+            corpus = list(corpus)  # counted four times
+        words_freq, num_unique = count_hashed_ngrams(corpus, n, ngram_range, n_features)
+        top_words, num_words = count_hashed_ngrams(corpus, n_words, (1, 1), n_features)
+        return words_freq, top_words
+
+    vec = CountVectorizer(ngram_range=(1, ngram_range[1]))
+    bag_of_words = vec.fit_transform(corpus)
+    sum_words = np.asarray(bag_of_words.sum(axis=0)).ravel()
+
+    terms = np.empty(len(sum_words), dtype=object)
+    sizes = np.empty(len(sum_words), dtype=np.intp)
+    for word, idx in vec.vocabulary_.items():
+        terms[idx] = word
+        sizes[idx] = word.count(' ') + 1
+
+    def get_top(columns, top_n):
+        # columns are in vocabulary order, so ties come out in the same order as in count_ngrams
+        top = columns[top_n_indices(sum_words[columns], top_n)]
+        return [(terms[idx], int(sum_words[idx])) for idx in top]
+
+    words_freq = get_top(np.flatnonzero(sizes >= ngram_range[0]), n)
+    top_words = get_top(np.flatnonzero(sizes == 1), n_words)
+    return words_freq, top_words
+
+
+def count_corpus_keys(codes, doc_ends, size, base):
+    """
+    Function to count the n-grams of one size in the token codes of a corpus, encoded as integers in base `base`
+    Output: sorted unique keys, their counts
+    """
+    starts = np.flatnonzero(np.arange(len(codes)) + size <= doc_ends)  # n-grams don't cross documents
+    keys = np.zeros(len(starts), dtype=np.int64)
+    for i in range(size):
+        keys = keys * base + codes[starts + i]
+    return np.unique(keys, return_counts=True)
+
+
+def get_top_keys(groups, top_n, get_term):
+    """
+    Function to get the top n-grams out of counted keys of several sizes
+    Input: list of (size, sorted keys, counts), number of n-grams to return, function (size, key) -> n-gram
+    Output: list of (n-gram, count), highest count first and ties in alphabetical order
+    """
+    if top_n <= 0 or not groups:
+        return []
+    counts = np.concatenate([group_counts for size, keys, group_counts in groups])
+    if len(counts) == 0:
+        return []
+
+    # count of the n-th n-gram - everything counted more often is in, of the ties only the first ones are needed
+    threshold = np.partition(counts, len(counts) - top_n)[len(counts) - top_n] if top_n < len(counts) else 0
+    candidates = []
+    for size, keys, group_counts in groups:
+        # keys are in alphabetical order of their n-grams, so the first top_n ties of each size are enough
+        above = np.flatnonzero(group_counts > threshold)
+        tied = np.flatnonzero(group_counts == threshold)[:top_n]
+        for idx in np.concatenate([above, tied]).tolist():
+            candidates.append((get_term(size, int(keys[idx])), int(group_counts[idx])))
+    candidates.sort(key=lambda x: (-x[1], x[0]))
+    return candidates[:top_n]
+
+
+class NgramCounts:
+    """
+    N-gram counts of a corpus or a part of it - the tokens in alphabetical order, and for each n-gram size the
+    sorted keys (positions of the n-gram's tokens in `tokens`, as the digits of a number in base len(tokens))
+    with their counts. Keys of one size sort like the n-gram strings, as the separating space sorts before
+    every word character.
+    """
+    def __init__(self, tokens, groups):
+        self.tokens = tokens
+        self.groups = groups
+
+    def get_term(self, size, key):
+        digits = []
+        for _ in range(size):
+            key, digit = divmod(key, len(self.tokens))
+            digits.append(self.tokens[digit])
+        return ' '.join(reversed(digits))
+
+
+def is_countable(tokens, max_size):
+    """
+    Function to check that CountVectorizer would take every token as it is, and that the keys fit into int64
+    """
+    return len(tokens) ** max_size < 2 ** 63 and \
+        all(token == token.lower() and token_pattern.fullmatch(token) for token in tokens)
+
+
+def count_corpus_ngrams(corpus, max_size=3):
+    """
+    Function to count the 1- to max_size-grams of a TokenCorpus on its token ids
+    Output: NgramCounts, None if the corpus can't be counted on its ids (see is_countable)
+    """
+    ids, offsets = corpus.get_arrays()
+    used = np.unique(ids)
+    ranked = np.array(sorted(used.tolist(), key=corpus.vocabulary.tokens.__getitem__), dtype=np.int64)
+    tokens = [corpus.vocabulary.tokens[token_id] for token_id in ranked.tolist()]
+    if not is_countable(tokens, max_size):
+        return None
+
+    # tokens are coded by their alphabetical rank
+    ranks = np.empty(len(ranked), dtype=np.int64)
+    ranks[np.searchsorted(used, ranked)] = np.arange(len(ranked))
+    codes = ranks[np.searchsorted(used, ids)]
+    doc_ends = np.repeat(offsets[1:], np.diff(offsets))
+
+    groups = {size: count_corpus_keys(codes, doc_ends, size, len(tokens)) for size in range(1, max_size + 1)}
+    return NgramCounts(tokens, groups)
+
+
+def merge_ngram_counts(partials, max_size=3):
+    """
+    Function to add up the n-gram counts of the parts of a corpus
+    Input: list of NgramCounts (count_corpus_ngrams of each part)
+    Output: NgramCounts of the whole corpus, None if a part or the whole can't be counted on ids
+    """
+    if any(partial is None for partial in partials):
+        return None
+    tokens = sorted(set().union(*(partial.tokens for partial in partials)))
+    if not is_countable(tokens, max_size):
+        return None
+    index = {token: position for position, token in enumerate(tokens)}
+    partials = [partial for partial in partials if partial.tokens]
+
+    groups = {}
+    for size in range(1, max_size + 1):
+        all_keys = [np.array([], dtype=np.int64)]
+        all_counts = [np.array([], dtype=np.int64)]
+        for partial in partials:
+            # re-encode the keys of the part with the positions of its tokens in the merged token list
+            positions = np.array([index[token] for token in partial.tokens], dtype=np.int64)
+            keys, counts = partial.groups[size]
+            merged_keys = np.zeros(len(keys), dtype=np.int64)
+            multiplier = 1
+            for _ in range(size):
+                keys, digits = np.divmod(keys, len(partial.tokens))
+                merged_keys += positions[digits] * multiplier
+                multiplier *= len(tokens)
+            all_keys.append(merged_keys)
+            all_counts.append(counts)
+
+        keys, inverse = np.unique(np.concatenate(all_keys), return_inverse=True)
+        counts = np.bincount(inverse.ravel(), weights=np.concatenate(all_counts), minlength=len(keys))
+        groups[size] = (keys, counts.astype(np.int64))
+    return NgramCounts(tokens, groups)
+
+
+def get_top_ngrams(ngram_counts, n=20, n_words=150, ngram_range=(2, 3)):
+    """
+    Function to get the top n-grams and the top single words out of NgramCounts
+    """
+    groups = ngram_counts.groups
+    words_freq = get_top_keys([(size,) + groups[size] for size in range(ngram_range[0], ngram_range[1] + 1)], n,
+                              ngram_counts.get_term)
+    top_words = get_top_keys([(1,) + groups[1]], n_words, ngram_counts.get_term)
+    return words_freq, top_words
+
+
+def count_corpus_ngrams_and_words(corpus, n=20, n_words=150, ngram_range=(2, 3), n_features=None,
+                                  ngram_counts=None):
+    """
+    Function to get the top n-grams and the top single words of a TokenCorpus, counted on the token ids
+    Input: TokenCorpus, number of n-grams to return, number of words to return, n-gram sizes, number of hash buckets,
+           NgramCounts of the corpus if already counted (e.g. merged from parts of it)
+    Output: same as count_ngrams_and_words on the texts of the corpus
+    """
+    if n_features is None and ngram_counts is None:
+        ngram_counts = count_corpus_ngrams(corpus, ngram_range[1])
+    if n_features is not None or ngram_counts is None or not ngram_counts.tokens:
+        return count_ngrams_and_words(list(corpus.iter_texts()), n, n_words, ngram_range, n_features)
+    return get_top_ngrams(ngram_counts, n, n_words, ngram_range)
+
+
+def count_hashed_ngrams(corpus, n, ngram_range, n_features):
+    """
+    Hashing mode of count_ngrams - buckets are ranked first, then a second pass over the corpus recovers the
+    n-grams behind the top buckets with their exact counts. A single-pass iterator is turned into a list first.
+    """
+    if iter(corpus) is corpus:
+        corpus = list(corpus)  # counted twice
+
+    vec = HashingVectorizer(ngram_range=ngram_range, n_features=n_features, alternate_sign=False, norm=None)
+    bag_of_words = vec.transform(corpus)
+    sum_words = np.asarray(bag_of_words.sum(axis=0)).ravel()
+    top = top_n_indices(sum_words, n)
+    if len(top) == 0:
+        return [], int(np.count_nonzero(sum_words))
+    # every bucket tied with the last of the top n too, so ties can be broken on the n-grams, not the buckets
+    wanted = set(np.flatnonzero(sum_words >= max(sum_words[top[-1]], 1)).tolist())
+
+    # only n-grams that fall into one of the top buckets are counted
+    analyzer = vec.build_analyzer()
+    counts = Counter()
+    for doc in corpus:
+        counts.update(gram for gram in analyzer(doc) if get_bucket(gram, n_features) in wanted)
+
+    # keep the most frequent n-gram of each bucket, other n-grams in the same bucket are hash collisions
+    best = {}
+    for gram, count in counts.items():
+        bucket = get_bucket(gram, n_features)
+        if bucket not in best or (-count, gram) < (-best[bucket][1], best[bucket][0]):
+            best[bucket] = (gram, count)
+    words_freq = sorted(best.values(), key=lambda x: (-x[1], x[0]))[:n]
+
+    return words_freq, int(np.count_nonzero(sum_words))
@@ -0,0 +1,198 @@
+"""
+Phrase_models.py module keeps the bigram / trigram phrase models on disk and updates them incrementally as new
+corpora come in, instead of training both models from scratch on every request.
+
+Requests only apply the frozen models (Phraser), which is a single linear pass over the tokens. The tokens of
+every phrased corpus are spooled to disk and folded into the full Phrases models in the background with
+add_vocab, so phrase quality improves as data accumulates. Models are kept globally, or per user when
+app.config['PHRASE_MODELS_PER_USER'] is set.
+
+Layout: phrase_models/<scope>/{bigram.phrases, trigram.phrases, bigram.phraser, trigram.phraser, generation,
+pending/*.txt}
+"""
+import os
+import fcntl
+import secrets
+import multiprocessing
+import gensim
+from flaskblog import app
+from flaskblog.NLP.helpers import iter_batches
+from flaskblog.jobs import submit_job
+
+PHRASE_MODELS_DIR = os.path.join(app.root_path, 'phrase_models')
+
+# frozen models loaded in this process: scope -> (generation, bigram_mod, trigram_mod)
+loaded_phrasers = {}
+
+
+def get_scope(user_id=None):
+    if app.config['PHRASE_MODELS_PER_USER'] and user_id is not None:
+        return 'user_{}'.format(int(user_id))
+    return 'global'
+
+
+def get_scope_dir(scope):
+    return os.path.join(PHRASE_MODELS_DIR, scope)
+
+
+def get_generation(scope):
+    """
+    Function to get the version of the frozen models of a scope - 0 if there are none yet
+    """
+    try:
+        with open(os.path.join(get_scope_dir(scope), 'generation')) as file:
+            return int(file.read())
+    except (OSError, ValueError):
+        return 0
+
+
+def replace_file(path, save):
+    """
+    Function to save a file under a temporary name and move it into place, so readers never see half of it
+    """
+    tmp_path = '{}.{}.tmp'.format(path, secrets.token_hex(4))
+    save(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def save_phrase_models(scope, bigram, trigram):
+    """
+    Function to save the full models, freeze them and publish the frozen models as a new generation
+    """
+    scope_dir = get_scope_dir(scope)
+    os.makedirs(os.path.join(scope_dir, 'pending'), exist_ok=True)
+    models = [('bigram.phrases', bigram), ('trigram.phrases', trigram),
+              ('bigram.phraser', gensim.models.phrases.Phraser(bigram)),
+              ('trigram.phraser', gensim.models.phrases.Phraser(trigram))]
+    for filename, model in models:
+        # separately=[] keeps each model in a single file, so it can be moved into place in one step
+        replace_file(os.path.join(scope_dir, filename), lambda path: model.save(path, separately=[]))
+
+    generation = get_generation(scope) + 1
+
+    def write_generation(path):
+        with open(path, 'w') as file:
+            file.write(str(generation))
+
+    replace_file(os.path.join(scope_dir, 'generation'), write_generation)
+
+
+def merge_phrases(models):
+    """
+    Function to merge Phrases models that learnt their vocabulary on parts of a corpus - the counts are added up
+    the way add_vocab does, so the result is the same as learning the whole corpus in one model (unless the
+    vocabulary outgrows max_vocab_size and gets pruned)
+    Input: list of Phrases models with the same settings
+    Output: the merged model (the first model, updated)
+    """
+    merged = models[0]
+    for model in models[1:]:
+        merged.corpus_word_count += model.corpus_word_count
+        merged.min_reduce = max(merged.min_reduce, model.min_reduce)
+        for word, count in model.vocab.items():
+            merged.vocab[word] = merged.vocab.get(word, 0) + count
+        if len(merged.vocab) > merged.max_vocab_size:
+            gensim.utils.prune_vocab(merged.vocab, merged.min_reduce)
+            merged.min_reduce += 1
+    return merged
+
+
+def get_phrasers(scope):
+    """
+    Function to get the frozen bigram and trigram models of a scope, reloaded only when a new generation is saved
+    Output: (bigram_mod, trigram_mod), None if the scope has no models yet
+    """
+    generation = get_generation(scope)
+    if generation == 0:
+        return None
+
+    loaded = loaded_phrasers.get(scope)
+    if loaded is None or loaded[0] != generation:
+        scope_dir = get_scope_dir(scope)
+        bigram_mod = gensim.models.phrases.Phraser.load(os.path.join(scope_dir, 'bigram.phraser'))
+        trigram_mod = gensim.models.phrases.Phraser.load(os.path.join(scope_dir, 'trigram.phraser'))
+        loaded = loaded_phrasers[scope] = (generation, bigram_mod, trigram_mod)
+
+    return loaded[1], loaded[2]
+
+
+def spool_lines(scope, lines):
+    """
+    Function to queue a corpus for the next model update
+    Input: scope, iterable of sentences as space separated tokens
+    """
+    pending_dir = os.path.join(get_scope_dir(scope), 'pending')
+    os.makedirs(pending_dir, exist_ok=True)
+    path = os.path.join(pending_dir, '{}.txt'.format(secrets.token_hex(8)))
+
+    def write_lines(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.writelines(line + '\n' for line in lines)
+
+    replace_file(path, write_lines)
+
+
+def spool_tokens(scope, token_lists):
+    spool_lines(scope, (' '.join(tokens) for tokens in token_lists))
+
+
+def read_pending(paths):
+    for path in paths:
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                yield line.split()
+
+
+def update_phrase_models(scope, batch_size=10000):
+    """
+    Function to fold the spooled corpora into the full Phrases models and publish new frozen models
+    Only one process updates a scope at a time; others return right away.
+    """
+    scope_dir = get_scope_dir(scope)
+    os.makedirs(scope_dir, exist_ok=True)
+    with open(os.path.join(scope_dir, 'update.lock'), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return  # an update of this scope is already running
+
+        pending_dir = os.path.join(scope_dir, 'pending')
+        paths = sorted(os.path.join(pending_dir, name) for name in os.listdir(pending_dir) if name.endswith('.txt'))
+        if not paths:
+            return
+
+        bigram = gensim.models.Phrases.load(os.path.join(scope_dir, 'bigram.phrases'))
+        trigram = gensim.models.Phrases.load(os.path.join(scope_dir, 'trigram.phrases'))
+        for batch in iter_batches(read_pending(paths), batch_size):
+            bigram.add_vocab(batch)
+
+        # the trigram model learns from the text phrased by the updated bigram model
+        bigram_mod = gensim.models.phrases.Phraser(bigram)
+        for batch in iter_batches(read_pending(paths), batch_size):
+            trigram.add_vocab([bigram_mod[tokens] for tokens in batch])
+
+        save_phrase_models(scope, bigram, trigram)
+        for path in paths:
+            os.remove(path)
+
+
+def count_pending_bytes(scope):
+    pending_dir = os.path.join(get_scope_dir(scope), 'pending')
+    try:
+        return sum(entry.stat().st_size for entry in os.scandir(pending_dir) if entry.name.endswith('.txt'))
+    except OSError:
+        return 0
+
+
+def schedule_phrase_update(scope):
+    """
+    Function to start a model update once enough text is pending - as a background job from a web worker,
+    inline when already running in a background process
+    """
+    if count_pending_bytes(scope) < app.config['PHRASE_UPDATE_MIN_BYTES']:
+        return
+
+    if multiprocessing.current_process().name != 'MainProcess':
+        update_phrase_models(scope)
+    else:
+        submit_job('phrase_update', None, scope)
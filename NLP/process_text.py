@@ -1,61 +1,311 @@
 from flaskblog.NLP.utils import *
 import pandas as pd
+import tempfile
 from flask import session
 import pyLDAvis.gensim
+from flaskblog.NLP.cache import analysis_cache, read_static_file, restore_static_file
+from flaskblog.NLP.charts import get_spec_filename
+from flaskblog.NLP.topic_model import get_model_id
+from flaskblog.NLP.ngrams import count_ngrams_and_words, count_corpus_ngrams, merge_ngram_counts, get_top_ngrams
+from flaskblog.NLP.shards import use_workers, use_shards, imap_shards, run_sharded_phrases
+from flaskblog.utils import iter_file_sentences
+from flaskblog.results import store_session_result, set_session_result, save_result_chunks
+from flaskblog.artifacts import register_artifact
+from flaskblog.metrics import timed_stage
+from flaskblog.NLP.phrase_models import get_scope, get_generation, get_phrasers, save_phrase_models, spool_lines, \
+    schedule_phrase_update
+from flask_login import current_user
 
 df_temp = pd.DataFrame()
 
+TOP_N_BIGRAMS = 300
+NGRAM_MERGE_BATCHES = 32  # n-gram counts of the phrased batches of an upload are merged this many at a time
+
+
+def restore_wordcloud(cached, user_id=None):
+    # the image itself is rendered again from the spec when it is requested
+    restore_static_file('wordclouds', get_spec_filename(cached['wc_filename']), cached['wordcloud_spec'])
+    register_artifact('wordclouds', cached['wc_filename'], user_id)
+
+
+def get_cached_top_bigrams(cache_key, user_id=None):
+    cached = analysis_cache.get(cache_key, 'top_bigrams')
+    if cached is None:
+        return None
+    restore_wordcloud(cached, user_id)
+    return cached['bigrams'], cached['phrases'], cached['wc_filename']
+
+
+def save_top_bigrams(top_bigrams, top_words, pipeline, user_id=None):
+    """
+    Function to save the wordcloud of the top words - the image is rendered in the background
+    Output: top bigrams data-frame, wordcloud filename, cache entry of both
+    """
+    df_bigrams = pd.DataFrame(top_bigrams, columns=['Text', 'count'])
+    with timed_stage(pipeline, 'save_wordcloud', rows_in=len(top_words)):
+        filename = save_wordcloud(top_words)
+    register_artifact('wordclouds', filename, user_id)
+
+    cached = {'bigrams': df_bigrams,
+              'wc_filename': filename,
+              'wordcloud_spec': read_static_file('wordclouds', get_spec_filename(filename))}
+    return df_bigrams, filename, cached
+
+
+def finish_top_bigrams(corpus, cache_key, pipeline, user_id=None, ngram_counts=None):
+    """
+    Final stages of run_top_bigrams - wordcloud, top bigrams and caching
+    Input: TokenCorpus of the phrased data, its NgramCounts if already counted (by the shards)
+    """
+    # get top n bigrams, and the word counts for the wordcloud from the same count
+    with timed_stage(pipeline, 'get_bigrams', rows_in=len(corpus)) as record:
+        top_bigrams, top_words = get_bigrams_and_words(corpus, TOP_N_BIGRAMS, n_features=NGRAM_HASH_FEATURES,
+                                                       ngram_counts=ngram_counts)
+        record.rows_out = len(top_bigrams)
+
+    df_bigrams, filename, cached = save_top_bigrams(top_bigrams, top_words, pipeline, user_id)
+
+    df_data = pd.DataFrame({'phrase': list(corpus.iter_texts())})
+    cached['phrases'] = df_data
+    analysis_cache.put(cache_key, 'top_bigrams', cached)
+
+    return df_bigrams, df_data, filename
+
+
+def run_top_bigrams(df, user_id=None):
+    """
+    Runs the phrase pipeline without touching the session so it can also run in a background job
+    Input: DataFrame with a 'data' column, id of the user (selects per-user phrase models if enabled)
+    Output: top bigrams, phrased data and wordcloud filename
+    """
+    scope = get_scope(user_id)
+    cache_key = analysis_cache.make_key(df['data'], min_count=PHRASES_MIN_COUNT, threshold=PHRASES_THRESHOLD,
+                                        n=TOP_N_BIGRAMS, n_features=NGRAM_HASH_FEATURES, phrase_scope=scope,
+                                        phrase_generation=get_generation(scope))
+    cached = get_cached_top_bigrams(cache_key, user_id)
+    if cached is not None:
+        return cached
 
-def get_top_bigrams(df):
     # stack data into sentences inside data-frame
-    df_data = get_sentences_df(df)
+    with timed_stage('top_bigrams', 'get_sentences_df', rows_in=len(df)) as record:
+        df_data = get_sentences_df(df)
+        record.rows_out = len(df_data)
+
+    if use_shards(len(df_data)):
+        # large corpora are cleaned, phrased and counted in shards on several processes
+        with timed_stage('top_bigrams', 'sharded_phrases', rows_in=len(df_data)) as record:
+            corpus, ngram_counts = run_sharded_phrases(df_data['sentences'].tolist(), scope)
+            record.rows_out = len(corpus)
+        return finish_top_bigrams(corpus, cache_key, 'top_bigrams', user_id, ngram_counts)
 
     # clean up data
-    df_data['clean_data'] = df_data['sentences'].apply(cleanup_text)
-    df_data = df_data[['clean_data']]
+    with timed_stage('top_bigrams', 'cleanup_text', rows_in=len(df_data)) as record:
+        corpus = TokenCorpus.from_token_lists(cleanup_token_lists(df_data['sentences']))
+        record.rows_out = len(corpus)
 
     # get phrases
-    df_data = get_phrases(df_data)
+    with timed_stage('top_bigrams', 'get_phrases', rows_in=len(corpus)) as record:
+        corpus = get_phrases(corpus, scope)
+        record.rows_out = len(corpus)
+
+    return finish_top_bigrams(corpus, cache_key, 'top_bigrams', user_id)
+
+
+def read_lines(file):
+    file.seek(0)
+    for line in file:
+        yield line[:-1]
+
+
+class SpooledLines:
+    """
+    Lines of a spooled file that can be read more than once (e.g. by the two passes of the hashed n-gram count)
+    """
+    def __init__(self, file):
+        self.file = file
+
+    def __iter__(self):
+        return read_lines(self.file)
+
+
+def iter_phrase_chunks(phrases):
+    """
+    Function to get phrases as data-frames of app.config['EXPORT_CHUNK_ROWS'] rows - at least one, maybe empty
+    """
+    empty = True
+    for batch in iter_batches(phrases, app.config['EXPORT_CHUNK_ROWS']):
+        empty = False
+        yield pd.DataFrame({'phrase': batch})
+    if empty:
+        yield pd.DataFrame({'phrase': pd.Series([], dtype=object)})
 
-    # generate and save wordcloud
-    filename = save_wordcloud(df_data)
+
+def store_phrases(user_id, phrases):
+    """
+    Function to stream phrases into the result store chunk by chunk
+    Input: id of the user, iterable of phrased sentences
+    Output: analysis id of the stored phrases, None without a user
+    """
+    if user_id is None:
+        return None
+    return save_result_chunks(user_id, 'phrases', iter_phrase_chunks(phrases))
+
+
+def get_cached_top_bigrams_file(cache_key, user_id=None):
+    cached = analysis_cache.get(cache_key, 'top_bigrams_file')
+    phrases = analysis_cache.iter_lines(cache_key, 'phrases') if cached is not None else None
+    if phrases is None:
+        return None
+    restore_wordcloud(cached, user_id)
+    return cached['bigrams'], store_phrases(user_id, phrases), cached['wc_filename']
+
+
+def run_top_bigrams_file(file_name, user_id=None, content_hash=None, batch_size=SPACY_BATCH_SIZE):
+    """
+    Memory bounded version of run_top_bigrams for uploaded files
+    Sentences are streamed from the file and cleaned batch by batch; the cleaned text is spooled to a temporary
+    file and the phrase models are trained incrementally. The phrased text is spooled to a second file and its
+    n-grams are counted batch by batch, so neither the raw nor the phrased text is held in memory as a whole.
+    Input: name of the uploaded file, id of the user, sha256 of the file if known (saves re-reading the file for
+           the cache key), number of sentences per batch
+    Output: top bigrams, analysis id of the phrased data in the result store (None without a user), wordcloud
+            filename
+    """
+    scope = get_scope(user_id)
+    corpus = [content_hash] if content_hash else iter_file_sentences(file_name)
+    cache_key = analysis_cache.make_key(corpus, min_count=PHRASES_MIN_COUNT, threshold=PHRASES_THRESHOLD,
+                                        n=TOP_N_BIGRAMS, n_features=NGRAM_HASH_FEATURES, phrase_scope=scope,
+                                        phrase_generation=get_generation(scope), stream=True,
+                                        content_hash=bool(content_hash))
+    cached = get_cached_top_bigrams_file(cache_key, user_id)
+    if cached is not None:
+        return cached
+
+    phrasers = get_phrasers(scope)
+    with tempfile.TemporaryFile(mode='w+', encoding='utf-8') as clean_file, \
+            tempfile.TemporaryFile(mode='w+', encoding='utf-8') as phrase_file:
+        # clean up data (and without stored phrase models, learn the bigram vocabulary) one batch at a time
+        with timed_stage('top_bigrams_file', 'cleanup_text') as record:
+            record.rows_in = 0
+            bigram = None
+            if phrasers is None:
+                bigram = gensim.models.Phrases(min_count=PHRASES_MIN_COUNT, threshold=PHRASES_THRESHOLD)
+            # with shard workers the file is read in shards of SHARD_SENTENCES sentences, which go to the workers a
+            # few at a time - a file of a single shard is cleaned in this process (see imap_shards)
+            shard_size = app.config['SHARD_SENTENCES'] if use_workers() else batch_size
+            batches = iter_batches(iter_file_sentences(file_name), shard_size)
+            for clean_batch in imap_shards(cleanup_token_lists, batches, batch_size):
+                if bigram is not None:
+                    bigram.add_vocab(clean_batch)
+                clean_file.writelines(' '.join(tokens) + '\n' for tokens in clean_batch)
+                record.rows_in += len(clean_batch)
+            record.rows_out = record.rows_in
+
+        with timed_stage('top_bigrams_file', 'get_phrases', rows_in=record.rows_out) as record:
+            if phrasers is None:
+                bigram_mod = gensim.models.phrases.Phraser(bigram)
+
+                # learn the trigram vocabulary on the bigram phrased text
+                trigram = gensim.models.Phrases(threshold=PHRASES_THRESHOLD)
+                for batch in iter_batches(read_lines(clean_file), batch_size):
+                    trigram.add_vocab([bigram_mod[get_tokens(text)] for text in batch])
+                trigram_mod = gensim.models.phrases.Phraser(trigram)
+                save_phrase_models(scope, bigram, trigram)
+            else:
+                # apply the stored models and queue this corpus for their next update
+                bigram_mod, trigram_mod = phrasers
+                spool_lines(scope, read_lines(clean_file))
+                schedule_phrase_update(scope)
+
+            # get phrases batch by batch - spooled to a file and their n-grams counted on the way
+            record.rows_out = 0
+            partials = [] if NGRAM_HASH_FEATURES is None else None
+            for batch in iter_batches(read_lines(clean_file), batch_size):
+                batch_corpus = TokenCorpus.from_token_lists(trigram_mod[bigram_mod[get_tokens(text)]]
+                                                            for text in batch)
+                phrase_file.writelines(text + '\n' for text in batch_corpus.iter_texts())
+                record.rows_out += len(batch_corpus)
+                if partials is not None:
+                    partials.append(count_corpus_ngrams(batch_corpus))
+                if partials is not None and len(partials) == NGRAM_MERGE_BATCHES:
+                    ngram_counts = merge_ngram_counts(partials)
+                    partials = [ngram_counts] if ngram_counts is not None else None
+
+        # get top n bigrams, and the word counts for the wordcloud from the same count
+        with timed_stage('top_bigrams_file', 'get_bigrams', rows_in=record.rows_out) as record:
+            ngram_counts = merge_ngram_counts(partials) if partials else None
+            if ngram_counts is not None and ngram_counts.tokens:
+                top_bigrams, top_words = get_top_ngrams(ngram_counts, TOP_N_BIGRAMS, WORDCLOUD_MAX_WORDS, (2, 3))
+            else:
+                # hashed counts, or tokens that can't be counted on ids - CountVectorizer over the spooled phrases
+                top_bigrams, top_words = count_ngrams_and_words(SpooledLines(phrase_file), TOP_N_BIGRAMS,
+                                                                WORDCLOUD_MAX_WORDS, (2, 3), NGRAM_HASH_FEATURES)
+            record.rows_out = len(top_bigrams)
+
+        df_bigrams, filename, cached = save_top_bigrams(top_bigrams, top_words, 'top_bigrams_file', user_id)
+        analysis_cache.put(cache_key, 'top_bigrams_file', cached)
+        analysis_cache.put_lines(cache_key, 'phrases', read_lines(phrase_file))
+
+        # store phrased data for later access, straight from the spooled file
+        phrases_id = store_phrases(user_id, read_lines(phrase_file))
+
+    return df_bigrams, phrases_id, filename
+
+
+def save_phrase_results(df_data, filename):
     session['wc_filename'] = filename
 
-    # store phrased data in session for later access
-    dict_phrases = df_data.to_dict('list')
-    session['dict_phrases'] = dict_phrases
+    # store phrased data for later access
+    store_session_result('phrases', df_data)
 
-    # get top n bigrams
-    top_bigrams = get_bigrams(df_data['phrase'], 300)
-    df_bigrams = pd.DataFrame(top_bigrams, columns=['Text', 'count'])
 
+def get_top_bigrams(df):
+    df_bigrams, df_data, filename = run_top_bigrams(df, current_user.id)
+    save_phrase_results(df_data, filename)
     return df_bigrams
 
 
-def get_main_topics(df):
-    df['tokens'] = df['phrase'].apply(get_tokens)
-    df = df[['tokens']]
-    id2word, bow_corpus, tfidf_corpus = transform_review(df)
-    lda_model = gensim.models.ldamodel.LdaModel(corpus=bow_corpus,
-                                                id2word=id2word,
-                                                num_topics=7,
-                                                random_state=100,
-                                                update_every=1,
-                                                chunksize=100,
-                                                passes=10,
-                                                alpha='auto',
-                                                per_word_topics=True)
-    vis = pyLDAvis.gensim.prepare(lda_model, bow_corpus, dictionary=id2word)
-    vis_filename = save_pyldavis(vis)
-    # get topics from model and structure into dataframe
-    topics_list = []
-    for i in range(len(lda_model.print_topics())):
-        topics_list.append(lda_model.print_topics()[i][1])
+def get_top_bigrams_file(file_name, content_hash=None):
+    df_bigrams, phrases_id, filename = run_top_bigrams_file(file_name, current_user.id, content_hash)
+    session['wc_filename'] = filename
+    set_session_result('phrases', phrases_id)
+    return df_bigrams
+
+
+def get_main_topics(df, user_id=None):
+    """
+    Input: phrased data, id of the user who owns the generated pyLDAvis page (None to leave it untracked)
+    Output: topics data-frame, pyLDAvis filename
+    """
+    cache_key = analysis_cache.make_key(df['phrase'], min_count=PHRASES_MIN_COUNT, threshold=PHRASES_THRESHOLD,
+                                        num_topics=NUM_TOPICS, vis_mds=LDA_VIS_MDS,
+                                        vis_lambda_step=app.config['LDA_VIS_LAMBDA_STEP'],
+                                        vis_large_vocabulary=app.config['LDA_VIS_LARGE_VOCABULARY'])
+    cached = analysis_cache.get(cache_key, 'topics')
+    if cached is not None:
+        restore_static_file('lda_vis', cached['vis_filename'] + '.gz', cached['vis_gz'])
+        register_artifact('lda_vis', cached['vis_filename'], user_id)
+        return cached['topics'], cached['vis_filename']
 
-    final_topic_list = []
-    for topic in topics_list:
-        final_topic_list.append(clean_lda_topics(topic))
+    model_id = get_model_id(df, NUM_TOPICS)
+    with timed_stage('main_topics', 'get_topic_model', rows_in=len(df)):
+        lda_model, id2word, bow_corpus = get_topic_model(df, NUM_TOPICS, model_id)
+
+    # the visualization is prepared once per topic model
+    vis_settings = get_pyldavis_settings(len(id2word))
+    vis_filename = get_pyldavis_filename(model_id, vis_settings)
+    if not os.path.exists(os.path.join(app.root_path, 'static', 'lda_vis', vis_filename + '.gz')):
+        with timed_stage('main_topics', 'pyldavis', rows_in=len(df)):
+            save_pyldavis(prepare_pyldavis(lda_model, bow_corpus, id2word, vis_settings), vis_filename)
+
+    # get topics from model and structure into dataframe
+    with timed_stage('main_topics', 'get_topics_df') as record:
+        df_topics = get_topics_df(lda_model)
+        record.rows_out = len(df_topics)
 
-    df_topics = pd.DataFrame.from_records(final_topic_list).T
+    analysis_cache.put(cache_key, 'topics', {'topics': df_topics,
+                                             'vis_filename': vis_filename,
+                                             'vis_gz': read_static_file('lda_vis', vis_filename + '.gz')})
+    register_artifact('lda_vis', vis_filename, user_id)
 
     return df_topics, vis_filename
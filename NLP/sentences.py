@@ -0,0 +1,21 @@
+"""
+Sentences.py module holds the sentence splitting rule shared by the NLP pipeline and the upload reader.
+It only depends on the standard library so it can be imported without loading the NLP stack.
+"""
+import re
+
+# splits after '.', '?' or '!' followed by whitespace, but not after abbreviations like "e.g." or "Mr."
+sentence_pattern = re.compile(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!)\s')
+
+
+def iter_sentence_spans(text):
+    """
+    Function to find the sentences of a text as offsets into it - the same pieces sentence_pattern.split returns
+    Input: text
+    Output: iterator of (start, end) offsets
+    """
+    start = 0
+    for match in sentence_pattern.finditer(text):
+        yield start, match.start()
+        start = match.end()
+    yield start, len(text)
@@ -0,0 +1,174 @@
+"""
+Shards.py module runs the cleanup, phrase and n-gram stages of large corpora on several processes, map-reduce
+style.
+
+Only background job processes use shard workers - the web process is threaded, so it never starts processes of
+its own and runs every stage in-process. Each job process keeps one shard pool for all of its jobs, with its share
+of the app.config['SHARD_WORKERS'] budget. The workers are started from a forkserver (spawned where that isn't
+available) instead of being forked from the job process, and load the NLP models once when they start.
+
+The sentences are split into shards of app.config['SHARD_SENTENCES'] sentences. The worker processes clean
+their shards, learn the phrase model vocabularies of their shards and count the n-grams of their phrased
+shards; the parent merges the vocabularies into the phrase models and adds up the n-gram counts. Both are sums
+over the sentences, so the result is the same as running the whole corpus in a single process.
+
+With stored phrase models the shards go through the workers once (clean, phrase, count). Without them the
+bigram model has to be complete before the trigram vocabulary can be learnt, so the shards go through three
+times (clean + bigram vocabulary, trigram vocabulary, phrase + count).
+"""
+import itertools
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import gensim
+from flaskblog import app
+from flaskblog.jobs import is_job_process
+from flaskblog.NLP.utils import cleanup_token_lists, get_nlp, get_stop_word_set, PHRASES_MIN_COUNT, \
+    PHRASES_THRESHOLD
+from flaskblog.NLP.token_corpus import TokenCorpus
+from flaskblog.NLP.ngrams import count_corpus_ngrams, merge_ngram_counts
+from flaskblog.NLP.phrase_models import get_phrasers, save_phrase_models, spool_tokens, schedule_phrase_update, \
+    merge_phrases
+
+executor = None
+
+
+def get_shard_workers():
+    """
+    Function to get the number of shard workers of a job process - the budget of all job processes together
+    (app.config['SHARD_WORKERS'], None for the cores left over by the job processes) split evenly between them
+    """
+    budget = app.config['SHARD_WORKERS']
+    if budget is None:
+        budget = multiprocessing.cpu_count() - app.config['JOB_WORKERS']
+    return max(budget // app.config['JOB_WORKERS'], 1)
+
+
+def use_workers():
+    """
+    Function to check if shards can go to worker processes - only from a job process, and daemonic processes
+    can't start them
+    """
+    return is_job_process() and get_shard_workers() > 1 and not multiprocessing.current_process().daemon
+
+
+def init_shard_worker():
+    # load the spaCy model and the stop words once per worker instead of with its first shard
+    get_nlp()
+    get_stop_word_set()
+
+
+def get_executor():
+    """
+    Function to create the shard pool of the job process on first use
+    """
+    global executor
+    if executor is None:
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        executor = ProcessPoolExecutor(max_workers=get_shard_workers(),
+                                       mp_context=multiprocessing.get_context(start_method),
+                                       initializer=init_shard_worker)
+    return executor
+
+
+def get_shards(sentences, shard_size=None):
+    shard_size = shard_size or app.config['SHARD_SENTENCES']
+    return [sentences[start:start + shard_size] for start in range(0, len(sentences), shard_size)]
+
+
+def use_shards(num_sentences):
+    return num_sentences > app.config['SHARD_SENTENCES'] and use_workers()
+
+
+def imap_shards(function, shards, *args):
+    """
+    Function to run function(shard, *args) for every shard on the worker processes - at most two shards per worker
+    are submitted at a time, so a streamed input is read only that far ahead. A single shard runs in this process.
+    Output: iterator of the results, in the order of the shards
+    """
+    shards = iter(shards)
+    head = list(itertools.islice(shards, 2))
+    if len(head) < 2 or not use_workers():
+        for shard in itertools.chain(head, shards):
+            yield function(shard, *args)
+        return
+
+    pending = collections.deque()
+    for shard in itertools.chain(head, shards):
+        pending.append(get_executor().submit(function, shard, *args))
+        if len(pending) >= 2 * get_shard_workers():
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# functions run by the workers
+
+def clean_shard(sentences):
+    """
+    Function to clean a shard and learn its bigram vocabulary
+    Output: TokenCorpus of the cleaned sentences, Phrases model of the shard
+    """
+    corpus = TokenCorpus.from_token_lists(cleanup_token_lists(sentences))
+    return corpus, gensim.models.Phrases(corpus, min_count=PHRASES_MIN_COUNT, threshold=PHRASES_THRESHOLD)
+
+
+def learn_trigram_shard(corpus, bigram_mod):
+    return gensim.models.Phrases(bigram_mod[corpus], threshold=PHRASES_THRESHOLD)
+
+
+def phrase_shard(corpus, bigram_mod, trigram_mod, max_size):
+    """
+    Function to phrase a cleaned shard and count its n-grams
+    Output: TokenCorpus of the phrased sentences, NgramCounts of the shard (None if it can't be counted on ids)
+    """
+    phrased = TokenCorpus.from_token_lists((trigram_mod[bigram_mod[tokens]] for tokens in corpus), corpus.vocabulary)
+    return phrased, count_corpus_ngrams(phrased, max_size)
+
+
+def clean_phrase_shard(sentences, scope, bigram_mod, trigram_mod, max_size):
+    """
+    Function to clean a shard, phrase it with the stored models of the scope and count its n-grams
+    The models are loaded once by the parent, so every shard is phrased by the same generation even if an update
+    publishes a new one during the run. The cleaned shard is queued for the next update, like in get_phrases.
+    """
+    corpus = TokenCorpus.from_token_lists(cleanup_token_lists(sentences))
+    spool_tokens(scope, corpus)
+    return phrase_shard(corpus, bigram_mod, trigram_mod, max_size)
+
+
+def run_sharded_phrases(sentences, scope='global', max_size=3):
+    """
+    Function to clean and phrase the sentences and count their n-grams, shard by shard on the worker processes
+    Input: list of sentences, phrase model scope, largest n-gram size to count
+    Output: TokenCorpus of the phrased sentences (same as get_phrases), NgramCounts of the phrased sentences
+            (None if they can't be counted on ids)
+    """
+    shards = get_shards(sentences)
+    num_shards = len(shards)
+    pool = get_executor()
+
+    phrasers = get_phrasers(scope)
+    if phrasers is None:
+        # no stored models yet - learn them from this corpus like get_phrases does, from the merged shard vocabularies
+        cleaned = list(pool.map(clean_shard, shards))
+        corpora = [corpus for corpus, bigram in cleaned]
+        bigram = merge_phrases([bigram for corpus, bigram in cleaned])
+        bigram_mod = gensim.models.phrases.Phraser(bigram)
+
+        trigram = merge_phrases(list(pool.map(learn_trigram_shard, corpora, [bigram_mod] * num_shards)))
+        trigram_mod = gensim.models.phrases.Phraser(trigram)
+        save_phrase_models(scope, bigram, trigram)
+
+        results = list(pool.map(phrase_shard, corpora, [bigram_mod] * num_shards, [trigram_mod] * num_shards,
+                                [max_size] * num_shards))
+    else:
+        bigram_mod, trigram_mod = phrasers
+        results = list(pool.map(clean_phrase_shard, shards, [scope] * num_shards, [bigram_mod] * num_shards,
+                                [trigram_mod] * num_shards, [max_size] * num_shards))
+        schedule_phrase_update(scope)
+
+    corpus = TokenCorpus()
+    for phrased, ngram_counts in results:
+        corpus.extend(phrased)
+    return corpus, merge_ngram_counts([ngram_counts for phrased, ngram_counts in results], max_size)
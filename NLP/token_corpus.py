@@ -0,0 +1,139 @@
+"""
+Token_corpus.py module holds a tokenized corpus as integer ids - one interned vocabulary, a flat array with the
+token ids of all documents and an array with the offset of each document - instead of space separated strings
+that every stage splits and joins again.
+
+The phrase, n-gram (and wordcloud) and topic stages all read the same corpus: the phrase models take the
+documents as token lists, the n-grams are counted on the ids (ngrams.count_corpus_ngrams_and_words) and the
+gensim dictionary and BOW corpus of the topic model are built from the ids and the vocabulary (get_bow_dictionary).
+
+Ids are assigned the way gensim's Dictionary assigns them (the new tokens of a document in sorted order), so the
+dictionary built from a corpus is the same as gensim.corpora.Dictionary built from its token lists.
+"""
+from array import array
+import numpy as np
+
+
+class Vocabulary:
+    """
+    Interned tokens - token2id maps a token to its id, tokens[id] is the token
+    """
+    def __init__(self):
+        self.token2id = {}
+        self.tokens = []
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def intern(self, tokens):
+        """
+        Function to get the ids of the tokens of a document, adding the new tokens to the vocabulary
+        """
+        token2id = self.token2id
+        for token in sorted({token for token in tokens if token not in token2id}):
+            token2id[token] = len(self.tokens)
+            self.tokens.append(token)
+        return [token2id[token] for token in tokens]
+
+
+class TokenCorpus:
+    """
+    Documents as token ids - the tokens of document i are ids[offsets[i]:offsets[i + 1]]
+    Iterating the corpus yields each document as a list of tokens, so it can be handed to gensim as it is.
+    Corpora derived from each other (e.g. cleaned and phrased text) can share one vocabulary.
+    """
+    def __init__(self, vocabulary=None):
+        self.vocabulary = vocabulary if vocabulary is not None else Vocabulary()
+        self.ids = array('i')
+        self.offsets = array('q', [0])
+
+    @classmethod
+    def from_token_lists(cls, token_lists, vocabulary=None):
+        corpus = cls(vocabulary)
+        for tokens in token_lists:
+            corpus.add_document(tokens)
+        return corpus
+
+    @classmethod
+    def from_texts(cls, texts, vocabulary=None):
+        return cls.from_token_lists((str(text).split() for text in texts), vocabulary)
+
+    def add_document(self, tokens):
+        self.ids.extend(self.vocabulary.intern(tokens))
+        self.offsets.append(len(self.ids))
+
+    def extend(self, other):
+        """
+        Function to append the documents of another corpus, which may have a vocabulary of its own
+        """
+        id_map = np.array(self.vocabulary.intern(other.vocabulary.tokens), dtype=np.int32)
+        other_ids, other_offsets = other.get_arrays()
+        self.offsets.frombytes((other_offsets[1:] + len(self.ids)).tobytes())
+        self.ids.frombytes(id_map[other_ids].astype(np.int32).tobytes())
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_document(self, i):
+        tokens = self.vocabulary.tokens
+        return [tokens[token_id] for token_id in self.ids[self.offsets[i]:self.offsets[i + 1]]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.get_document(i)
+
+    def iter_texts(self):
+        """
+        Function to get the documents back as space separated text
+        """
+        for tokens in self:
+            yield ' '.join(tokens)
+
+    def get_arrays(self):
+        """
+        Function to get the token ids and the document offsets as numpy arrays
+        """
+        return np.array(self.ids, dtype=np.int64), np.array(self.offsets, dtype=np.int64)
+
+    def get_bow_dictionary(self, no_below=15, no_above=0.6, keep_n=100000):
+        """
+        Function to get the gensim dictionary and the BOW corpus of the documents
+        Input: filter_extremes settings of the dictionary
+        Output: dictionary (id2word) with the tokens that pass the filters, BOW corpus - the same as
+                Dictionary(token lists) filtered with filter_extremes and doc2bow of every document
+        """
+        from gensim import corpora
+
+        ids, offsets = self.get_arrays()
+        num_tokens = max(len(self.vocabulary), 1)
+        doc_ids = np.repeat(np.arange(len(self), dtype=np.int64), np.diff(offsets))
+
+        # one entry per (document, token) pair, in document order and token id order within a document
+        pairs, pair_counts = np.unique(doc_ids * num_tokens + ids, return_counts=True)
+        pair_docs, pair_tokens = np.divmod(pairs, num_tokens)
+        dfs = np.bincount(pair_tokens, minlength=num_tokens)
+        cfs = np.bincount(ids, minlength=num_tokens)
+
+        # the dictionary holds the tokens that occur in this corpus (a shared vocabulary may hold others too)
+        present = np.flatnonzero(dfs)
+        id2word = corpora.Dictionary()
+        id2word.token2id = {self.vocabulary.tokens[token_id]: new_id for new_id, token_id in enumerate(present)}
+        id2word.dfs = {new_id: int(dfs[token_id]) for new_id, token_id in enumerate(present)}
+        id2word.cfs = {new_id: int(cfs[token_id]) for new_id, token_id in enumerate(present)}
+        id2word.num_docs = len(self)
+        id2word.num_pos = len(ids)
+        id2word.num_nnz = len(pairs)
+        id2word.filter_extremes(no_below=no_below, no_above=no_above, keep_n=keep_n)
+
+        # filtering keeps the order of the ids, so the BOW of every document stays sorted by id
+        id_map = np.full(num_tokens, -1, dtype=np.int64)
+        for token, new_id in id2word.token2id.items():
+            id_map[self.vocabulary.token2id[token]] = new_id
+        pair_ids = id_map[pair_tokens]
+        kept = pair_ids >= 0
+        pair_docs, pair_ids, pair_counts = pair_docs[kept], pair_ids[kept].tolist(), pair_counts[kept].tolist()
+
+        bounds = np.searchsorted(pair_docs, np.arange(len(self) + 1)).tolist()
+        bow_corpus = [list(zip(pair_ids[bounds[i]:bounds[i + 1]], pair_counts[bounds[i]:bounds[i + 1]]))
+                      for i in range(len(self))]
+        return id2word, bow_corpus
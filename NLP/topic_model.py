@@ -0,0 +1,145 @@
+"""
+Topic_model.py module trains the LDA topic model and keeps it on disk, so the topic table, the topic downloads
+and the pyLDAvis visualization are all served from a single trained model.
+
+Models are stored under topic_models/<model_id>/ together with their dictionary (id2word) and BOW corpus.
+The model id is a hash of the phrased corpus, the model parameters and the trainer (LdaMulticore, or LdaModel
+where worker processes can't be started), so the same phrases always map to the same model. The least recently
+used models are deleted once topic_models/ is over app.config['TOPIC_MODELS_MAX_BYTES'].
+"""
+import os
+import shutil
+import tempfile
+import multiprocessing
+import pandas as pd
+import gensim
+from gensim import corpora
+from flaskblog import app
+from flaskblog.NLP.helpers import clean_lda_topics
+from flaskblog.NLP.token_corpus import TokenCorpus
+from flaskblog.NLP.cache import analysis_cache
+
+TOPIC_MODELS_DIR = os.path.join(app.root_path, 'topic_models')
+
+LDA_PASSES = 10
+
+
+def get_trainer():
+    # daemonic processes (e.g. pool workers) can't start the LdaMulticore workers
+    return 'lda' if multiprocessing.current_process().daemon else 'lda_multicore'
+
+
+def get_model_id(df_phrases, num_topics):
+    return analysis_cache.make_key(df_phrases['phrase'], num_topics=num_topics, passes=LDA_PASSES,
+                                   model=get_trainer())
+
+
+def train_lda(bow_corpus, id2word, num_topics):
+    """
+    Function to train the LDA model on all cores (app.config['LDA_WORKERS'] worker processes)
+    """
+    if get_trainer() == 'lda':
+        # single core, with the parameters of the original model (LdaMulticore doesn't support alpha='auto')
+        return gensim.models.ldamodel.LdaModel(corpus=bow_corpus,
+                                               id2word=id2word,
+                                               num_topics=num_topics,
+                                               random_state=100,
+                                               update_every=1,
+                                               chunksize=100,
+                                               passes=LDA_PASSES,
+                                               alpha='auto',
+                                               per_word_topics=True)
+
+    return gensim.models.ldamulticore.LdaMulticore(corpus=bow_corpus,
+                                                   id2word=id2word,
+                                                   num_topics=num_topics,
+                                                   workers=app.config['LDA_WORKERS'],
+                                                   random_state=100,
+                                                   chunksize=100,
+                                                   passes=LDA_PASSES,
+                                                   per_word_topics=True)
+
+
+def save_topic_model(model_id, lda_model, id2word, bow_corpus):
+    """
+    Function to save a trained model - written to a temporary directory first and then moved into place,
+    so other workers never load a half written model
+    """
+    os.makedirs(TOPIC_MODELS_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=TOPIC_MODELS_DIR)
+    lda_model.save(os.path.join(tmp_dir, 'lda.model'))
+    id2word.save(os.path.join(tmp_dir, 'id2word.dict'))
+    corpora.MmCorpus.serialize(os.path.join(tmp_dir, 'bow_corpus.mm'), bow_corpus)
+    try:
+        os.rename(tmp_dir, os.path.join(TOPIC_MODELS_DIR, model_id))
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)  # another worker saved the same model first
+    evict_topic_models()
+
+
+def evict_topic_models():
+    """
+    Function to delete the least recently used models until topic_models/ fits in
+    app.config['TOPIC_MODELS_MAX_BYTES'] (the directory modification time is used as the last access time)
+    """
+    models = []
+    for entry in os.scandir(TOPIC_MODELS_DIR):
+        if not entry.is_dir() or entry.name.startswith('tmp'):
+            continue  # models being written
+        try:
+            size = sum(file.stat().st_size for file in os.scandir(entry.path))
+            models.append((entry.stat().st_mtime, size, entry.path))
+        except OSError:
+            continue  # deleted by another worker in the meantime
+
+    total = sum(size for _, size, _ in models)
+    for _, size, path in sorted(models):
+        if total <= app.config['TOPIC_MODELS_MAX_BYTES']:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def load_topic_model(model_id):
+    model_dir = os.path.join(TOPIC_MODELS_DIR, model_id)
+    try:
+        os.utime(model_dir)  # mark as recently used
+    except OSError:
+        return None
+    try:
+        lda_model = gensim.models.ldamodel.LdaModel.load(os.path.join(model_dir, 'lda.model'))
+        id2word = corpora.Dictionary.load(os.path.join(model_dir, 'id2word.dict'))
+        bow_corpus = corpora.MmCorpus(os.path.join(model_dir, 'bow_corpus.mm'))
+    except OSError:
+        return None  # evicted by another worker while loading
+    return lda_model, id2word, bow_corpus
+
+
+def get_topic_model(df_phrases, num_topics, model_id=None):
+    """
+    Function to get the topic model for the phrased data, trained only if it hasn't been saved before
+    Input: DataFrame with a 'phrase' column, number of topics, model id if already known
+    Output: LDA model, dictionary (id2word), BOW corpus
+    """
+    model_id = model_id or get_model_id(df_phrases, num_topics)
+    topic_model = load_topic_model(model_id)
+    if topic_model is not None:
+        return topic_model
+
+    # dictionary and BOW corpus straight from the token ids (same as transform_review)
+    id2word, bow_corpus = TokenCorpus.from_texts(df_phrases['phrase']).get_bow_dictionary()
+    lda_model = train_lda(bow_corpus, id2word, num_topics)
+    save_topic_model(model_id, lda_model, id2word, bow_corpus)
+
+    return lda_model, id2word, bow_corpus
+
+
+def get_topics_df(lda_model):
+    """
+    Function to get the words of each topic
+    Output: DataFrame with one column per topic
+    """
+    topics_list = [topic for _, topic in lda_model.print_topics()]
+    final_topic_list = [clean_lda_topics(topic) for topic in topics_list]
+
+    return pd.DataFrame.from_records(final_topic_list).T
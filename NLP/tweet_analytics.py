@@ -0,0 +1,58 @@
+"""
+Tweet_analytics.py module computes the hashtag counts and the tweet timeline of the twitter dashboard with
+vectorized pandas operations - the hashtag lists are exploded into one column and counted, and the timestamps
+are bucketed natively (floor / to_period) instead of formatting every timestamp as a string.
+"""
+import pandas as pd
+
+# bucket -> (pandas frequency, label format, axis label)
+TIMELINE_BUCKETS = {
+    'hour': ('h', '%Y-%m-%d %H:00', 'YYYY-MM-DD HH:00'),
+    'day': ('D', '%Y-%m-%d', 'YYYY-MM-DD'),
+    'week': ('W-SUN', '%Y-%m-%d', 'Week starting YYYY-MM-DD'),
+    'month': ('M', '%Y-%m', 'YYYY-MM'),
+}
+
+
+def get_hashtag_counts(hashtags):
+    """
+    Function to count hashtags
+    Input: Series of hashtag lists
+    Output: DataFrame with hashtags and count, most frequent first (ties in alphabetical order)
+    """
+    counts = hashtags.explode().dropna().value_counts(sort=False).sort_index()
+    counts = counts.sort_values(ascending=False, kind='mergesort')
+    return pd.DataFrame({'hashtags': counts.index.astype(str), 'count': counts.values})
+
+
+def get_timeline(datetimes, bucket='month'):
+    """
+    Function to count tweets per time bucket
+    Input: Series of tweet timestamps, bucket (one of TIMELINE_BUCKETS)
+    Output: DataFrame with the period label and count of each bucket that has tweets, oldest first
+    """
+    freq, label_format, axis_label = TIMELINE_BUCKETS[bucket]
+    datetimes = pd.to_datetime(datetimes)
+    if datetimes.dt.tz is not None:
+        datetimes = datetimes.dt.tz_convert(None)  # buckets in UTC
+
+    if freq in ('h', 'D'):
+        periods = datetimes.dt.floor(freq)
+    else:
+        periods = datetimes.dt.to_period(freq).dt.start_time
+
+    counts = periods.value_counts(sort=False).sort_index()
+    return pd.DataFrame({'period': counts.index.strftime(label_format), 'count': counts.values})
+
+
+def analyze_tweets(df_tweets, bucket='month'):
+    """
+    Function to get the hashtag counts and the timeline of the tweets in one go
+    Input: tweets DataFrame (hashtags and datetime columns), timeline bucket
+    Output: hashtag counts DataFrame, timeline DataFrame
+    """
+    return get_hashtag_counts(df_tweets['hashtags']), get_timeline(df_tweets['datetime'], bucket)
+
+
+def get_timeline_axis_label(bucket):
+    return TIMELINE_BUCKETS[bucket][2]
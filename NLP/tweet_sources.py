@@ -0,0 +1,227 @@
+"""
+Tweet_sources.py module fetches tweets for a search query from a pluggable source.
+
+The date range is split into windows that double in length going back in time (1 day, 2 days, 4 days, ...),
+so the recent, dense part of the timeline is fetched in small pieces and the sparse past in a few large ones.
+Windows are fetched newest first on a thread pool (app.config['TWEET_FETCH_WORKERS'] at a time), and no new
+windows are started once the finished windows hold enough tweets; the windows still running are then told to
+stop, so they don't keep using the search quota. Each window collects its tweets column by column, and the
+columns are joined into a single data-frame at the end.
+
+Sources:
+    GetOldTweetsSource - searches Twitter with GetOldTweets3
+    JsonlReplaySource  - replays tweets saved as JSON lines, for offline load tests and benchmarks
+                         ({"id", "username", "date" (ISO format), "text", "hashtags" (string or list)} per line)
+app.config['TWEET_REPLAY_FILE'] switches the app to a replay file.
+"""
+import os
+import json
+import bisect
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import pandas as pd
+from flaskblog import app
+
+TWEET_COLUMNS = ['id', 'username', 'datetime', 'text', 'hashtags']
+
+# length of the newest window, each older window is twice as long as the one before
+FIRST_WINDOW_DAYS = 1
+# tweets GetOldTweets3 fetches between two checks of the stop flag of a window
+FETCH_BUFFER_TWEETS = 100
+
+
+class TweetSource:
+    """
+    Interface of the tweet sources - fetch yields (id, username, datetime, text, hashtags) for one window
+    """
+    def fetch(self, text_query, since, until, max_tweets, stop=None):
+        """
+        Input: search query, first day of the window, day after the window (datetime.date), maximum number of
+               tweets, threading.Event set when the tweets are no longer needed (sources stop fetching early)
+        Output: iterable of tweets, newest first
+        """
+        raise NotImplementedError
+
+
+class FetchStopped(Exception):
+    pass
+
+
+class GetOldTweetsSource(TweetSource):
+    def fetch(self, text_query, since, until, max_tweets, stop=None):
+        import GetOldTweets3 as got
+
+        def check_stop(tweets):
+            # called by GetOldTweets3 after every FETCH_BUFFER_TWEETS tweets
+            if stop is not None and stop.is_set():
+                raise FetchStopped()
+
+        tweet_criteria = got.manager.TweetCriteria().setQuerySearch(text_query) \
+            .setMaxTweets(max_tweets) \
+            .setSince(str(since)) \
+            .setUntil(str(until)) \
+            .setLang('en')
+        try:
+            tweets = got.manager.TweetManager.getTweets(tweet_criteria, receiveBuffer=check_stop,
+                                                        bufferLength=FETCH_BUFFER_TWEETS)
+        except FetchStopped:
+            return
+        for tweet in tweets:
+            yield int(tweet.id), str(tweet.username), tweet.date, tweet.text, tweet.hashtags.split()
+
+
+class JsonlReplaySource(TweetSource):
+    """
+    Replays a JSON lines file - a tweet matches the query if its text contains every word of the query
+    The file is parsed on the first fetch into a list of tweets sorted newest first; each window is a slice of it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tweets = None
+        self.day_keys = None  # minus the day ordinal of each tweet, ascending
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.tweets is not None:
+                return
+            tweets = []
+            with open(self.path, encoding='utf-8') as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    hashtags = record.get('hashtags') or []
+                    if isinstance(hashtags, str):
+                        hashtags = hashtags.split()
+                    tweets.append((int(record['id']), str(record['username']),
+                                   datetime.datetime.fromisoformat(record['date']), record['text'], hashtags))
+
+            tweets.sort(key=lambda tweet: tweet[2], reverse=True)
+            self.day_keys = [-tweet[2].date().toordinal() for tweet in tweets]
+            self.tweets = [(tweet, tweet[3].lower()) for tweet in tweets]
+
+    def fetch(self, text_query, since, until, max_tweets, stop=None):
+        self.load()
+        words = str(text_query).lower().split()
+
+        # tweets with since <= date < until
+        start = bisect.bisect_right(self.day_keys, -until.toordinal())
+        end = bisect.bisect_right(self.day_keys, -since.toordinal())
+        tweets = []
+        for tweet, text in self.tweets[start:end]:
+            if len(tweets) >= max_tweets:
+                break
+            if all(word in text for word in words):
+                tweets.append(tweet)
+        return tweets
+
+
+# replay file path -> (modification time, source), so each file is parsed once per process
+replay_sources = {}
+replay_sources_lock = threading.Lock()
+
+
+def get_replay_source(path):
+    mtime = os.path.getmtime(path)
+    with replay_sources_lock:
+        cached = replay_sources.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, JsonlReplaySource(path))  # the file changed since it was parsed
+            replay_sources[path] = cached
+        return cached[1]
+
+
+def get_tweet_source():
+    if app.config['TWEET_REPLAY_FILE']:
+        return get_replay_source(app.config['TWEET_REPLAY_FILE'])
+    return GetOldTweetsSource()
+
+
+class TweetBuffer:
+    """
+    Columnar buffer - tweets are appended to one list per column
+    """
+    def __init__(self):
+        self.columns = {column: [] for column in TWEET_COLUMNS}
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def extend(self, tweets):
+        for tweet in tweets:
+            for column, value in zip(TWEET_COLUMNS, tweet):
+                self.columns[column].append(value)
+
+
+def get_windows(since, until):
+    """
+    Function to split a date range into windows that double in length going back in time
+    Output: list of (since, until) pairs, newest first - until is the day after the window
+    """
+    windows = []
+    days = FIRST_WINDOW_DAYS
+    while until > since:
+        window_since = max(since, until - datetime.timedelta(days=days))
+        windows.append((window_since, until))
+        until = window_since
+        days *= 2
+    return windows
+
+
+def fetch_window(source, text_query, window, max_tweets, stop):
+    buffer = TweetBuffer()
+    if not stop.is_set():
+        buffer.extend(source.fetch(text_query, window[0], window[1], max_tweets, stop))
+    return buffer
+
+
+def ingest_tweets(text_query, count, since, until, source=None, max_workers=None):
+    """
+    Function to fetch the newest tweets for a query, fetching several windows of the date range at a time
+    Input: search query, number of tweets, first day, day after the last day (datetime.date), tweet source
+           (default get_tweet_source()), number of windows fetched at a time (default app.config)
+    Output: data-frame with the columns of TWEET_COLUMNS, newest first
+    """
+    source = source or get_tweet_source()
+    max_workers = max_workers or app.config['TWEET_FETCH_WORKERS']
+    windows = get_windows(since, until)
+    buffers = [None] * len(windows)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    stop = threading.Event()
+    running = {}
+    next_window = 0
+    try:
+        while running or next_window < len(windows):
+            # tweets in the newest windows that have all finished - the older windows can't displace them
+            num_ready = 0
+            for buffer in buffers:
+                if buffer is None:
+                    break
+                num_ready += len(buffer)
+            if num_ready >= count:
+                break
+
+            while next_window < len(windows) and len(running) < max_workers:
+                future = executor.submit(fetch_window, source, text_query, windows[next_window], count, stop)
+                running[future] = next_window
+                next_window += 1
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                buffers[running.pop(future)] = future.result()
+    finally:
+        # windows still being fetched are older than the tweets already collected - stop them, don't wait for them
+        stop.set()
+        executor.shutdown(wait=False)
+
+    # join the windows newest first
+    columns = {column: [] for column in TWEET_COLUMNS}
+    for buffer in buffers:
+        if buffer is not None:
+            for column in TWEET_COLUMNS:
+                columns[column].extend(buffer.columns[column])
+
+    return pd.DataFrame(columns, columns=TWEET_COLUMNS).head(count)
@@ -1,57 +1,29 @@
 from flask import session
-import GetOldTweets3 as got
-import pandas as pd
 import datetime
-from sklearn.feature_extraction.text import CountVectorizer
+from flaskblog.NLP.ngrams import count_ngrams
+from flaskblog.NLP.tweet_sources import ingest_tweets
+from flaskblog.NLP.tweet_analytics import get_hashtag_counts
 
+TWEETS_SINCE_DAYS = 10000  # how far back tweets are searched by default
 
-def get_tweets(text_query,
-               count=20,
-               since=str(datetime.date.today() + datetime.timedelta(days=-10000)),
-               until=str(datetime.date.today())
-               ):
-    text_query = str(text_query)
-    count = int(count)
-    tweet_criteria = got.manager.TweetCriteria().setQuerySearch(text_query) \
-        .setMaxTweets(count) \
-        .setSince(since) \
-        .setUntil(until) \
-        .setLang('en')
-    tweets = got.manager.TweetManager.getTweets(tweet_criteria)
 
-    # Creating list of chosen tweet data
-    text_tweets = [[tweet.id, tweet.username, tweet.date, tweet.text, tweet.hashtags] for tweet in tweets]
-
-    # structure results into dataframe
-    df_tweets = pd.DataFrame()
-    df_tweets['id'] = [int(tweet[0]) for tweet in text_tweets]
-    df_tweets['username'] = [str(tweet[1]) for tweet in text_tweets]
-    df_tweets['datetime'] = [tweet[2] for tweet in text_tweets]
-    df_tweets['text'] = [tweet[3] for tweet in text_tweets]
-    df_tweets['hashtags'] = [tweet[4].split() for tweet in text_tweets]
+def get_tweets(text_query, count=20, since=None, until=None, source=None):
+    """
+    Function to get the newest tweets for a query
+    Input: search query, number of tweets, first day and day after the last day ('YYYY-MM-DD', default the
+           TWEETS_SINCE_DAYS days before today), tweet source (default from app.config)
+    Output: data-frame with id, username, datetime, text and hashtags
+    """
+    until = datetime.date.fromisoformat(until) if until else datetime.date.today()
+    since = datetime.date.fromisoformat(since) if since else until - datetime.timedelta(days=TWEETS_SINCE_DAYS)
+    df_tweets = ingest_tweets(str(text_query), int(count), since, until, source=source)
 
     # get number of unique words
-    words_list = list(df_tweets['text'])
-    cv = CountVectorizer()
-    cv_fit = cv.fit_transform(words_list)
-    session['num_unique_words'] = len(cv.get_feature_names())
+    top_words, num_unique_words = count_ngrams(df_tweets['text'], n=0, ngram_range=(1, 1))
+    session['num_unique_words'] = num_unique_words
 
     return df_tweets
 
 
 def get_hashtags(df_tweets):
-    df_tweets_hashtags = df_tweets[["id", "hashtags"]]
-    df_hashtag_list = pd.DataFrame.from_records(df_tweets_hashtags['hashtags'].tolist()).stack().reset_index(
-        level=1,
-        drop=True).rename(
-        'hashtags')
-    df_tweets_hashtags = df_tweets_hashtags.drop('hashtags', axis=1).join(df_hashtag_list).reset_index(drop=True)[
-        ['id', 'hashtags']].dropna(subset=['hashtags'])
-    df_hashtag_count = df_tweets_hashtags.groupby(['hashtags']).count().reset_index()[['hashtags', 'id']]
-    df_hashtag_count.columns = ['hashtags', 'count']
-    df_hashtag_count.sort_values(by='count', ascending=False, inplace=True)
-    return df_hashtag_count
-
-
-def get_tweet_year_month(date_time):
-    return str(date_time.date())[0:7]
+    return get_hashtag_counts(df_tweets['hashtags'])
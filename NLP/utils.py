@@ -7,17 +7,26 @@ from flask import session, url_for
 from flaskblog.NLP.helpers import *
 import os
 from flaskblog import app
+import functools
+import threading
+import collections
 import unidecode
 import re
 import string
 import pandas as pd
+import numpy as np
 import spacy
-from sklearn.feature_extraction.text import CountVectorizer
-from wordcloud import WordCloud
+from array import array
+from flaskblog.NLP.sentences import iter_sentence_spans
+from flaskblog.NLP.ngrams import count_ngrams, count_corpus_ngrams_and_words
+from flaskblog.NLP.token_corpus import TokenCorpus
+from flaskblog.NLP.topic_model import get_topic_model, get_topics_df
+from flaskblog.NLP.phrase_models import get_phrasers, save_phrase_models, spool_tokens, schedule_phrase_update
+from flaskblog.NLP.charts import save_barplot, save_lineplot, save_wordcloud, WORDCLOUD_MAX_WORDS
 import matplotlib
-
-import matplotlib.pyplot as plt
 import secrets
+import gzip
+import hashlib
 import gensim
 from gensim.models import CoherenceModel
 import pyLDAvis.gensim
@@ -25,158 +34,309 @@ import pyLDAvis.gensim
 matplotlib.use('Agg')       # for displaying large vis files
 
 
-# main code
-stop_words = get_stopwords()
-
-nlp = spacy.load('en_core_web_sm')
-
-
-def get_bigrams(corpus, n=20):
-    vec = CountVectorizer(ngram_range=(2, 3)).fit(corpus)
-    bag_of_words = vec.transform(corpus)
-    sum_words = bag_of_words.sum(axis=0)
-    words_freq = [(word, sum_words[0, idx]) for word, idx in vec.vocabulary_.items()]
-    words_freq = sorted(words_freq, key=lambda x: x[1], reverse=True)
-    return words_freq[:n]
+# heavy resources are loaded on first use, see NLP/loader.py
+@functools.lru_cache(maxsize=None)
+def get_stop_word_set():
+    """
+    Function to load the stop words on first use
+    """
+    return frozenset(get_stopwords())
+
+
+@functools.lru_cache(maxsize=None)
+def get_nlp():
+    """
+    Function to load the spaCy model on first use
+    Only the tagger (POS tags + lemmas) is used, so the parser and NER are never loaded
+    """
+    return spacy.load('en_core_web_sm', disable=['parser', 'ner'])
+
+
+# number of sentences handed to spaCy at a time by cleanup_texts
+SPACY_BATCH_SIZE = 1000
+
+# cleaned tokens of the normalized texts this process has cleaned lately, least recently used first - kept across
+# requests, up to app.config['CLEANUP_MEMO_SIZE'] texts
+cleanup_memo = collections.OrderedDict()
+cleanup_memo_lock = threading.Lock()
+
+# pipeline parameters - these also make up the keys of the analysis cache
+PHRASES_MIN_COUNT = 15
+PHRASES_THRESHOLD = 100  # higher threshold fewer phrases.
+NUM_TOPICS = 7
+NGRAM_HASH_FEATURES = None  # set to a number of buckets to count n-grams with bounded memory
+# pyLDAvis settings - projecting the few topics is cheap with 'pcoa' (the default), the part that grows with the
+# vocabulary is ranking the terms for every step of the relevance slider (see get_pyldavis_settings)
+LDA_VIS_MDS = 'pcoa'
+LDA_VIS_COARSE_LAMBDA_STEP = 0.1  # 11 rankings instead of the 101 of pyLDAvis' default step of 0.01
+
+
+def get_bigrams(corpus, n=20, n_features=None):
+    words_freq, num_unique = count_ngrams(corpus, n=n, ngram_range=(2, 3), n_features=n_features)
+    return words_freq
+
+
+def get_bigrams_and_words(corpus, n=20, n_words=WORDCLOUD_MAX_WORDS, n_features=None, ngram_counts=None):
+    """
+    Function to get the top bigrams (and trigrams) and the top words for the wordcloud from a single count
+    Input: TokenCorpus of the phrased data, NgramCounts of it if already counted
+    """
+    return count_corpus_ngrams_and_words(corpus, n=n, n_words=n_words, ngram_range=(2, 3), n_features=n_features,
+                                         ngram_counts=ngram_counts)
+
+
+def get_sentence_offsets(texts):
+    """
+    Function to split texts into sentences as a flat table of offsets into the texts - one row per sentence,
+    so memory grows with the number of sentences and not with the longest text
+    Input: list of texts
+    Output: DataFrame with the position of the text (doc_id) and the start and end offsets of each sentence
+    """
+    doc_ids, starts, ends = array('q'), array('q'), array('q')
+    for doc_id, text in enumerate(texts):
+        for start, end in iter_sentence_spans(text):
+            doc_ids.append(doc_id)
+            starts.append(start)
+            ends.append(end)
+    return pd.DataFrame({'doc_id': np.asarray(doc_ids, dtype=np.int64),
+                         'start': np.asarray(starts, dtype=np.int64),
+                         'end': np.asarray(ends, dtype=np.int64)})
 
 
 def get_sentences_df(df_test):
-    df_test['sentences'] = df_test['data'].apply(get_sentences)
-    df_sentence_list = pd.DataFrame.from_records(df_test['sentences'].tolist()).stack().reset_index(level=1,
-                                                                                                    drop=True).rename(
-        'sentences')
-    df_test = df_test.drop('sentences', axis=1).join(df_sentence_list).reset_index(drop=True)[['sentences']]
-    return df_test
+    """
+    Function to split the documents into sentences
+    Input: DataFrame with a 'data' column
+    Output: DataFrame with the position of the document (doc_id) and the text of each sentence, in document order
+    """
+    texts = [str(text) for text in df_test['data']]
+    df_offsets = get_sentence_offsets(texts)
+    sentences = [texts[doc_id][start:end] for doc_id, start, end in
+                 zip(df_offsets['doc_id'].tolist(), df_offsets['start'].tolist(), df_offsets['end'].tolist())]
+    return pd.DataFrame({'doc_id': df_offsets['doc_id'], 'sentences': sentences})
 
 
 allowed_pos_tags = ['NOUN', 'VERB', 'PROPN']
 
 
-# function to clean the review_text
-def cleanup_text(review):
+# precompiled patterns and translation table for normalize_text / normalize_texts
+url_pattern = re.compile(r'https?://\S+')
+hashtag_pattern = re.compile(r'#\S+')
+username_pattern = re.compile(r'@\S+')
+whitespace_pattern = re.compile(r'\s+')
+# same as removing "(\d|\W)+" word by word, as runs never cross the single spaces between words
+digits_special_pattern = re.compile(r'(?:\d|[^\w\s])+')
+punctuation_table = str.maketrans(string.punctuation, ' ' * len(string.punctuation))
+
+
+def normalize_text(review):
+    """
+    Function to normalize a review before it is handed to spaCy
+    Input: review text
+    Output: lower-cased text without URLs, hashtags, usernames, accents, punctuation and digits
+    """
     review = str(review)
-    review = re.sub(r'https?://\S+', ' ', review)  # replace all URLs with space
-    review = re.sub(r'#\S+', ' ', review)  # replace all hashtags with space
-    review = re.sub(r'@\S+', ' ', review)  # replace all usernames with space
+    review = url_pattern.sub(' ', review)  # replace all URLs with space
+    review = hashtag_pattern.sub(' ', review)  # replace all hashtags with space
+    review = username_pattern.sub(' ', review)  # replace all usernames with space
 
     # remove accents from words
-    # review_clean = unicodedata.normalize('NFKD', review_clean).encode('ascii', 'ignore').decode('utf-8', 'ignore')
     review = unidecode.unidecode(review)
 
-    # replace punctuations with space
-    list1 = [char for char in review]
-    list2 = [' ' if char in string.punctuation else char for char in list1]
-    words_list = ''.join(list2).split()
+    # replace punctuations with space and collapse whitespace
+    review = ' '.join(review.translate(punctuation_table).split())
 
     # remove digits and special characters
-    words_list = [re.sub("(\\d|\\W)+", " ", word) for word in words_list]
+    review = digits_special_pattern.sub(' ', review)
 
     # convert words to lower case
-    words_list = [word.lower() for word in words_list]
-
-    review = ' '.join(words_list)
+    return review.lower()
+
+
+def normalize_texts(reviews):
+    """
+    Vectorized version of normalize_text for a whole Series of reviews
+    Input: Series or iterable of review texts
+    Output: Series of normalized texts with the same index
+    """
+    if not isinstance(reviews, pd.Series):
+        reviews = pd.Series(list(reviews), dtype=object)
+
+    reviews = reviews.map(str)
+    reviews = reviews.str.replace(url_pattern, ' ', regex=True)
+    reviews = reviews.str.replace(hashtag_pattern, ' ', regex=True)
+    reviews = reviews.str.replace(username_pattern, ' ', regex=True)
+    reviews = reviews.map(unidecode.unidecode)
+    reviews = reviews.str.translate(punctuation_table)
+    reviews = reviews.str.replace(whitespace_pattern, ' ', regex=True).str.strip()
+    reviews = reviews.str.replace(digits_special_pattern, ' ', regex=True)
+    return reviews.str.lower()
+
+
+def filter_token_list(doc):
+    """
+    Function to keep the lemmas of nouns, verbs and proper nouns in a spaCy doc
+    Input: spaCy doc
+    Output: list of cleaned tokens without stop words
+    """
+    stop_words = get_stop_word_set()
+    tokens = []
     # filter words with POS filtering and lemmatize words
-    review = nlp(review)
-    review = ' '.join(
-        [word.lemma_ if word.lemma_ != '-PRON-' else word.text for word in review if word.pos_ in allowed_pos_tags])
-
-    words_list = review.split()
-
-    # remove stop words
-    review_clean = ' '.join([word for word in words_list if word not in stop_words])
-
-    # remove extra whitespace
-    review_clean = re.sub('  +', ' ', review_clean)
-
-    review_clean = str(review_clean)
-    return review_clean
-
+    for word in doc:
+        if word.pos_ in allowed_pos_tags:
+            lemma = word.lemma_ if word.lemma_ != '-PRON-' else word.text
+            # remove stop words
+            tokens.extend(token for token in lemma.split() if token not in stop_words)
+    return tokens
 
-def get_phrases(df_test):
-    # tokenize the reviews
-    df_test['tokens'] = df_test['clean_data'].apply(get_tokens)
-    df_test = df_test[['tokens']]
-    # tokens = list(df_test['tokens'])
 
-    # Build the bigram and trigram models
-    bigram = gensim.models.Phrases(df_test['tokens'], min_count=15, threshold=100)  # higher threshold fewer phrases.
-    trigram = gensim.models.Phrases(bigram[df_test['tokens']], threshold=100)
+def filter_tokens(doc):
+    """
+    Function to keep the lemmas of nouns, verbs and proper nouns in a spaCy doc
+    Input: spaCy doc
+    Output: cleaned text without stop words
+    """
+    return ' '.join(filter_token_list(doc))
 
-    # Faster way to get a sentence clubbed as a trigram/bigram
-    bigram_mod = gensim.models.phrases.Phraser(bigram)
-    trigram_mod = gensim.models.phrases.Phraser(trigram)
 
-    df_test['phrase'] = df_test['tokens'].apply(trigram_phrase, trigram_mod=trigram_mod, bigram_mod=bigram_mod)
-    df_test = df_test[['phrase']]
-
-    return df_test
+# function to clean the review_text
+def cleanup_text(review):
+    return filter_tokens(get_nlp()(normalize_text(review)))
+
+
+def collapse_texts(texts):
+    """
+    Function to collapse duplicate texts (e.g. retweets)
+    Input: Series or iterable of texts
+    Output: list of the distinct texts in order of first occurrence, position of every text in that list
+    """
+    codes, uniques = pd.factorize(pd.Series(list(texts), dtype=object).map(str))
+    return list(uniques), codes
+
+
+def get_memo_tokens(texts):
+    """
+    Function to look up normalized texts in the cleanup memo
+    Output: list of the cleaned tokens of each text, None where the text isn't in the memo
+    """
+    with cleanup_memo_lock:
+        found = []
+        for text in texts:
+            tokens = cleanup_memo.get(text)
+            if tokens is not None:
+                cleanup_memo.move_to_end(text)
+            found.append(tokens)
+    return found
+
+
+def put_memo_tokens(cleaned):
+    """
+    Function to remember the cleaned tokens of normalized texts, dropping the least recently used ones over the limit
+    Input: dict of normalized text -> tuple of tokens
+    """
+    size = app.config['CLEANUP_MEMO_SIZE']
+    if not size:
+        return
+    with cleanup_memo_lock:
+        cleanup_memo.update(cleaned)
+        while len(cleanup_memo) > size:
+            cleanup_memo.popitem(last=False)
+
+
+def cleanup_token_lists(reviews, batch_size=SPACY_BATCH_SIZE):
+    """
+    Function to clean a whole collection of reviews in one go
+    Duplicate reviews are cleaned once, and only normalized texts that aren't in the cleanup memo go through spaCy
+    (POS tags depend on the whole sentence, so the lemma / POS results are remembered per normalized text).
+    Input: Series or iterable of review texts, number of texts per spaCy batch
+    Output: list of cleaned token lists, in the same order as the input (duplicates share one list)
+    """
+    unique_reviews, codes = collapse_texts(reviews)
+    texts = normalize_texts(unique_reviews).tolist()
+
+    cleaned = dict(zip(texts, get_memo_tokens(texts)))
+    missing = [text for text, tokens in cleaned.items() if tokens is None]
+    new_tokens = {text: tuple(filter_token_list(doc))
+                  for text, doc in zip(missing, get_nlp().pipe(missing, batch_size=batch_size))}
+    cleaned.update(new_tokens)
+    put_memo_tokens(new_tokens)
+
+    token_lists = {text: list(tokens) for text, tokens in cleaned.items()}
+    unique_token_lists = [token_lists[text] for text in texts]
+    return [unique_token_lists[code] for code in codes]
+
+
+def cleanup_texts(reviews, batch_size=SPACY_BATCH_SIZE):
+    """
+    Same as cleanup_token_lists, with every cleaned review as text
+    """
+    return [' '.join(tokens) for tokens in cleanup_token_lists(reviews, batch_size=batch_size)]
+
+
+def get_phrases(corpus, scope='global'):
+    """
+    Function to join the bigrams and trigrams of the cleaned sentences into phrases
+    Input: TokenCorpus of the cleaned sentences, phrase model scope
+    Output: TokenCorpus of the phrased sentences, sharing the vocabulary of the input
+    """
+    phrasers = get_phrasers(scope)
+    if phrasers is None:
+        # no stored models yet - build the bigram and trigram models from this corpus and store them
+        bigram = gensim.models.Phrases(corpus, min_count=PHRASES_MIN_COUNT, threshold=PHRASES_THRESHOLD)
+        # Faster way to get a sentence clubbed as a trigram/bigram
+        bigram_mod = gensim.models.phrases.Phraser(bigram)
+
+        trigram = gensim.models.Phrases(bigram_mod[corpus], threshold=PHRASES_THRESHOLD)
+        trigram_mod = gensim.models.phrases.Phraser(trigram)
+        save_phrase_models(scope, bigram, trigram)
+    else:
+        # apply the stored models and queue this corpus for their next update
+        bigram_mod, trigram_mod = phrasers
+        spool_tokens(scope, corpus)
+        schedule_phrase_update(scope)
+
+    return TokenCorpus.from_token_lists((trigram_mod[bigram_mod[tokens]] for tokens in corpus), corpus.vocabulary)
 
 
 def get_topics(df):
-    df['tokens'] = df['phrase'].apply(get_tokens)
-    df = df[['tokens']]
-    id2word, bow_corpus, tfidf_corpus = transform_review(df)
-    lda_model = gensim.models.ldamodel.LdaModel(corpus=bow_corpus,
-                                                id2word=id2word,
-                                                num_topics=7,
-                                                random_state=100,
-                                                update_every=1,
-                                                chunksize=100,
-                                                passes=10,
-                                                alpha='auto',
-                                                per_word_topics=True)
-
-    # get topics from model and structure into dataframe
-    topics_list = []
-    for i in range(len(lda_model.print_topics())):
-        topics_list.append(lda_model.print_topics()[i][1])
-
-    final_topic_list = []
-    for topic in topics_list:
-        final_topic_list.append(clean_lda_topics(topic))
-
-    df_topics = pd.DataFrame.from_records(final_topic_list).T
-
-    return df_topics
-
-
-def save_wordcloud(df_data):
-    phrases = ''.join(list(df_data['phrase']))
-    wordcloud = WordCloud(width=512, height=512, max_words=150, background_color="white").generate(phrases)
-    filename = secrets.token_hex(8) + '.png'
-    full_path = os.path.join(app.root_path, 'static/wordclouds', filename)
-    wordcloud.to_file(full_path)
-    return filename
-
-
-def save_barplot(df_data):
-    df_data = df_data.sort_values(by='count')
-    filename = secrets.token_hex(8) + '.png'
-    full_path = os.path.join(app.root_path, 'static/hashtags', filename)
-
-    # plot the fig
-    plt.figure(figsize=[12, 9])
-    plt.barh(list(df_data['hashtags']), list(df_data['count']), color='grey')
-    plt.xlabel('Total Count')
-    plt.ylabel('Hashtags')
-    plt.title('Top 20 hashtags')
-    plt.savefig(full_path)
-    return filename
-
-
-def save_lineplot(df_data):
-    filename = secrets.token_hex(8) + '.png'
-    full_path = os.path.join(app.root_path, 'static/twitter_timeline', filename)
-    plt.figure(figsize=[20, 5])
-    plt.xlabel('YYYY-MM')
-    plt.ylabel('# of Tweets')
-    plt.plot(list(df_data['year_month']), list(df_data['id']), color='darkblue')
-    plt.savefig(full_path)
-    return filename
-
-
-def save_pyldavis(vis):
-    filename = secrets.token_hex(8) + '.html'
-    full_path = os.path.join(app.root_path, 'static/lda_vis', filename)
-    pyLDAvis.save_html(vis, full_path)
+    lda_model, id2word, bow_corpus = get_topic_model(df, NUM_TOPICS)
+    return get_topics_df(lda_model)
+
+
+def get_pyldavis_settings(num_terms):
+    """
+    Function to get the pyLDAvis settings for a vocabulary of num_terms terms - pyLDAvis' own defaults, except
+    above app.config['LDA_VIS_LARGE_VOCABULARY'] terms, where the relevance slider moves in coarse steps and the
+    topics keep the order of the model instead of being sorted by size
+    Output: dict of keyword arguments for pyLDAvis.gensim.prepare
+    """
+    settings = {'mds': LDA_VIS_MDS, 'lambda_step': app.config['LDA_VIS_LAMBDA_STEP'], 'sort_topics': True}
+    if num_terms > app.config['LDA_VIS_LARGE_VOCABULARY']:
+        settings['lambda_step'] = max(settings['lambda_step'], LDA_VIS_COARSE_LAMBDA_STEP)
+        settings['sort_topics'] = False
+    return settings
+
+
+def get_pyldavis_filename(model_id, settings):
+    """
+    Function to get the filename of the visualization of a topic model - one per model and vis settings
+    """
+    key = '{}|{}|{}|{}'.format(model_id, settings['mds'], settings['lambda_step'], settings['sort_topics'])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16] + '.html'
+
+
+def prepare_pyldavis(lda_model, bow_corpus, id2word, settings):
+    return pyLDAvis.gensim.prepare(lda_model, bow_corpus, dictionary=id2word, **settings)
+
+
+def save_pyldavis(vis, filename):
+    """
+    Function to save the visualization gzip compressed, as <filename>.gz - it is served compressed as it is
+    """
+    full_path = os.path.join(app.root_path, 'static/lda_vis', filename + '.gz')
+    html = pyLDAvis.prepared_data_to_html(vis).encode('utf-8')
+    tmp_path = '{}.{}.tmp'.format(full_path, secrets.token_hex(4))
+    with open(tmp_path, 'wb') as file:
+        file.write(gzip.compress(html, compresslevel=9))
+    os.replace(tmp_path, full_path)
     return filename
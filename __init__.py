@@ -1,3 +1,4 @@
+import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
@@ -12,6 +13,38 @@ app.config['SECRET_KEY'] = 'ee31769c0a0d49b384d7bc70fe1fb3af'
 
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'  # /// -> relative path
 app.config['SESSION_TYPE'] = 'filesystem'  # to use Server side sessions
+app.config['JOB_WORKERS'] = 2  # processes used for the background NLP jobs
+app.config['ANALYSIS_JOBS'] = True  # run the analysis pages as background jobs, False runs them in the request
+app.config['JOB_POLL_SECONDS'] = 2  # how often the job wait page reloads
+app.config['JOB_TTL_SECONDS'] = 24 * 3600  # job statuses and results are deleted this long after their last update
+app.config['JOB_SWEEP_INTERVAL_SECONDS'] = 3600  # how often a worker looks for expired jobs
+app.config['ANALYSIS_CACHE_MAX_BYTES'] = 512 * 1024 * 1024  # size limit of the on-disk analysis cache
+app.config['TOPIC_MODELS_MAX_BYTES'] = 1024 * 1024 * 1024  # size limit of the stored topic models
+app.config['STREAM_UPLOAD_MIN_BYTES'] = 5 * 1024 * 1024  # uploads from this size on are streamed
+app.config['LDA_WORKERS'] = None  # processes used to train the topic model, None uses all cores but one
+app.config['NLP_WARM_UP'] = os.environ.get('NLP_WARM_UP') == '1'  # load the NLP stack at startup
+app.config['METRICS_LOG_STAGES'] = False  # log a per-stage timing breakdown for each analysis request
+app.config['PHRASE_MODELS_PER_USER'] = False  # keep separate phrase models for each user
+app.config['PHRASE_UPDATE_MIN_BYTES'] = 1024 * 1024  # pending text that triggers a phrase model update
+app.config['POSTS_PER_PAGE'] = 10
+app.config['UPLOADS_PER_PAGE'] = 20
+app.config['CHART_WORKERS'] = 1  # threads rendering the hashtag and timeline charts
+app.config['CHART_FORMAT'] = 'png'  # png or svg
+app.config['CHART_RENDER_TIMEOUT'] = 60  # seconds a chart request waits for its image
+app.config['ARTIFACT_TTL_SECONDS'] = 7 * 24 * 3600  # generated files and uploads unused this long are deleted
+app.config['ARTIFACT_USER_QUOTA_BYTES'] = 200 * 1024 * 1024  # disk space of generated files and uploads per user
+app.config['ARTIFACT_SWEEP_INTERVAL_SECONDS'] = 3600  # how often a worker looks for expired files
+app.config['ARTIFACT_MAX_AGE_SECONDS'] = 365 * 24 * 3600  # browser cache lifetime of generated files
+app.config['ARTIFACT_ACCEL_REDIRECT_PREFIX'] = None  # nginx internal location mapped to static/, e.g. '/_static/'
+app.config['TWEET_FETCH_WORKERS'] = 4  # date windows of a tweet search fetched at the same time
+app.config['TWEET_REPLAY_FILE'] = os.environ.get('TWEET_REPLAY_FILE')  # JSON lines file replacing Twitter search
+app.config['TWEET_TIMELINE_BUCKET'] = 'month'  # hour, day, week or month
+app.config['EXPORT_CHUNK_ROWS'] = 10000  # rows per chunk of a streamed download
+app.config['SHARD_WORKERS'] = None  # shard processes shared out between the job processes, None for the spare cores
+app.config['SHARD_SENTENCES'] = 20000  # sentences per shard, corpora up to this size run in a single process
+app.config['CLEANUP_MEMO_SIZE'] = 100000  # cleaned sentences each process remembers across requests, 0 for none
+app.config['LDA_VIS_LAMBDA_STEP'] = 0.01  # step of the pyLDAvis relevance slider (pyLDAvis' default)
+app.config['LDA_VIS_LARGE_VOCABULARY'] = 10000  # terms above which pyLDAvis uses coarse steps, unsorted topics
 Session(app)
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
@@ -20,3 +53,7 @@ login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'  # bootstrap category like success and danger
 
 from flaskblog import routes
+
+if app.config['NLP_WARM_UP']:
+    from flaskblog.NLP.loader import warm_up
+    warm_up()
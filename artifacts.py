@@ -0,0 +1,217 @@
+"""
+Artifacts.py module keeps track of the files generated under static/ (charts, wordclouds, pyLDAvis pages) and of
+the uploaded text files, cleans them up and serves them with HTTP caching.
+
+Every artifact is recorded in artifacts.db once per owner, with the last time that owner used it. An owner's
+reference expires when it hasn't been used for app.config['ARTIFACT_TTL_SECONDS'], and a user's least recently
+used artifacts are dropped once the user is over app.config['ARTIFACT_USER_QUOTA_BYTES']. Files shared by several
+users (charts and uploads are named after their contents) are only deleted once no owner is left.
+
+An artifact is every file <name>.* in its directory, e.g. a chart spec together with its rendered images.
+
+Artifact names never get new contents, so they are served with long-lived, immutable cache headers and an ETag.
+Files stored gzip compressed (<filename>.gz) are sent as they are to clients that accept gzip, and decompressed
+on the fly for the others.
+
+With app.config['ARTIFACT_ACCEL_REDIRECT_PREFIX'] (nginx) or app.config['USE_X_SENDFILE'] (Apache, lighttpd)
+the front-end server sends the bytes instead of the Python worker.
+"""
+import os
+import gzip
+import glob
+import time
+import zlib
+import sqlite3
+import mimetypes
+from urllib.parse import quote
+from flask import request, send_file
+from flaskblog import app
+
+ARTIFACTS_DB = os.path.join(app.root_path, 'artifacts.db')
+STATIC_DIR = os.path.join(app.root_path, 'static')
+
+ARTIFACT_DIRECTORIES = ('wordclouds', 'hashtags', 'twitter_timeline', 'lda_vis', 'text_files')
+# uploads are private, everything else may be served by name
+SERVED_DIRECTORIES = ('wordclouds', 'hashtags', 'twitter_timeline', 'lda_vis')
+
+last_sweep = 0.0
+
+
+def get_connection():
+    conn = sqlite3.connect(ARTIFACTS_DB, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')  # readers don't block the writer
+    conn.execute('CREATE TABLE IF NOT EXISTS artifacts ('
+                 'directory TEXT NOT NULL, name TEXT NOT NULL, user_id INTEGER NOT NULL, '
+                 'created REAL NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (directory, name, user_id))')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_artifacts_last_used ON artifacts (last_used)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_artifacts_user_last_used ON artifacts (user_id, last_used)')
+    return conn
+
+
+def get_artifact_name(filename):
+    return filename.partition('.')[0]
+
+
+def get_artifact_files(directory, name):
+    return glob.glob(os.path.join(STATIC_DIR, directory, glob.escape(name) + '.*'))
+
+
+def get_artifact_size(directory, name):
+    size = 0
+    for path in get_artifact_files(directory, name):
+        try:
+            size += os.path.getsize(path)
+        except OSError:
+            pass  # removed in the meantime
+    return size
+
+
+def get_artifact_path(directory, filename):
+    """
+    Function to get the path of a servable artifact
+    Output: path, None if the directory isn't served or there is no such file
+    """
+    if directory not in SERVED_DIRECTORIES or os.path.basename(filename) != filename:
+        return None
+    path = os.path.join(STATIC_DIR, directory, filename)
+    if os.path.isfile(path):
+        return path
+    return path + '.gz' if os.path.isfile(path + '.gz') else None
+
+
+def release_artifact(conn, directory, name, user_id):
+    """
+    Function to drop one owner's reference to an artifact and delete its files if no owner is left
+    """
+    conn.execute('DELETE FROM artifacts WHERE directory = ? AND name = ? AND user_id = ?', (directory, name, user_id))
+    owners = conn.execute('SELECT COUNT(*) FROM artifacts WHERE directory = ? AND name = ?',
+                          (directory, name)).fetchone()[0]
+    if owners == 0:
+        for path in get_artifact_files(directory, name):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def register_artifact(directory, filename, user_id):
+    """
+    Function to record that a user has created or used an artifact, then apply the quota and TTL
+    Input: directory under static/, filename, user id (nothing is recorded without one)
+    """
+    if user_id is None:
+        return
+
+    name = get_artifact_name(filename)
+    now = time.time()
+    with get_connection() as conn:
+        conn.execute('INSERT OR IGNORE INTO artifacts VALUES (?, ?, ?, ?, ?)', (directory, name, user_id, now, now))
+        conn.execute('UPDATE artifacts SET last_used = ? WHERE directory = ? AND name = ? AND user_id = ?',
+                     (now, directory, name, user_id))
+
+    evict_user_artifacts(user_id, keep=(directory, name))
+    if now - last_sweep >= app.config['ARTIFACT_SWEEP_INTERVAL_SECONDS']:
+        sweep_artifacts()
+
+
+def evict_user_artifacts(user_id, keep=None):
+    """
+    Function to drop a user's least recently used artifacts until the user is within the quota
+    Sizes are taken from disk, so images rendered after an artifact was registered are counted too.
+    Input: user id, (directory, name) of an artifact that must stay (the one just registered)
+    """
+    with get_connection() as conn:
+        rows = conn.execute('SELECT directory, name FROM artifacts WHERE user_id = ? ORDER BY last_used DESC',
+                            (user_id,)).fetchall()
+        total = 0
+        for directory, name in rows:
+            total += get_artifact_size(directory, name)
+            if total > app.config['ARTIFACT_USER_QUOTA_BYTES'] and (directory, name) != keep:
+                release_artifact(conn, directory, name, user_id)
+
+
+def sweep_artifacts():
+    """
+    Function to drop every reference unused for longer than the TTL, and to delete files that were never
+    registered (written before the artifact store existed, or left behind by a crash) once they are as old
+    """
+    global last_sweep
+    last_sweep = time.time()
+    expired = last_sweep - app.config['ARTIFACT_TTL_SECONDS']
+
+    with get_connection() as conn:
+        for directory, name, user_id in conn.execute('SELECT directory, name, user_id FROM artifacts '
+                                                     'WHERE last_used < ?', (expired,)).fetchall():
+            release_artifact(conn, directory, name, user_id)
+
+        for directory in ARTIFACT_DIRECTORIES:
+            known = {name for name, in conn.execute('SELECT DISTINCT name FROM artifacts WHERE directory = ?',
+                                                    (directory,))}
+            try:
+                entries = list(os.scandir(os.path.join(STATIC_DIR, directory)))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if get_artifact_name(entry.name) not in known and entry.stat().st_mtime < expired:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+
+def send_artifact(path, mimetype=None):
+    """
+    Function to serve a generated file with an ETag and long-lived cache headers, answering conditional requests
+    Input: path of the file, mimetype (guessed from the filename if not given)
+    Output: response
+    """
+    max_age = app.config['ARTIFACT_MAX_AGE_SECONDS']
+    prefix = app.config['ARTIFACT_ACCEL_REDIRECT_PREFIX']
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    if prefix:
+        # nginx sends the file from its internal location, the worker only sends the headers
+        stat = os.stat(path)
+        response = app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = prefix + quote(os.path.relpath(path, STATIC_DIR))
+        response.set_etag('{}-{}-{}'.format(stat.st_mtime, stat.st_size, zlib.adler32(path.encode('utf-8'))))
+        response.last_modified = stat.st_mtime
+        response = response.make_conditional(request)
+    else:
+        # send_file hands the file to the server itself when app.config['USE_X_SENDFILE'] is set
+        response = send_file(path, mimetype=mimetype, conditional=True, cache_timeout=max_age)
+
+    response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(max_age)
+    return response
+
+
+def iter_gzip_file(path, chunk_size=64 * 1024):
+    with gzip.open(path, 'rb') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def send_gzip_artifact(path, mimetype):
+    """
+    Function to serve a gzip compressed file - compressed if the client accepts gzip, else decompressed as a stream
+    Input: path of the .gz file, mimetype of the uncompressed contents
+    Output: response
+    """
+    if 'gzip' in request.accept_encodings:
+        response = send_artifact(path, mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        stat = os.stat(path)
+        response = app.response_class(iter_gzip_file(path), mimetype=mimetype)
+        response.set_etag('{}-{}-{}-identity'.format(stat.st_mtime, stat.st_size,
+                                                     zlib.adler32(path.encode('utf-8'))))
+        response.last_modified = stat.st_mtime
+        response = response.make_conditional(request)
+        response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(
+            app.config['ARTIFACT_MAX_AGE_SECONDS'])
+
+    response.vary.add('Accept-Encoding')
+    return response
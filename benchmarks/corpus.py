@@ -0,0 +1,120 @@
+"""
+Corpus.py generates synthetic, reproducible corpora for the benchmarks - tweets shaped like the output of
+NLP/twitter_data.get_tweets and uploaded documents shaped like utils.get_dataframe.
+
+Word frequencies follow a Zipf distribution and sentences are built from simple English templates, so the
+spaCy tagger, the phrase models and the n-gram counts see text that behaves roughly like the real thing.
+The same seed always gives the same corpus, so runs are comparable over time.
+"""
+import json
+import random
+import datetime
+import itertools
+import pandas as pd
+
+NOUNS = ['data', 'model', 'market', 'price', 'phone', 'battery', 'camera', 'screen', 'team', 'game', 'player',
+         'season', 'coach', 'city', 'traffic', 'weather', 'rain', 'movie', 'song', 'album', 'concert', 'ticket',
+         'school', 'student', 'teacher', 'election', 'vote', 'policy', 'vaccine', 'hospital', 'doctor', 'coffee',
+         'pizza', 'restaurant', 'service', 'delivery', 'order', 'customer', 'company', 'stock', 'bank', 'loan',
+         'house', 'rent', 'flight', 'airport', 'hotel', 'beach', 'update', 'app', 'website', 'account', 'password']
+PROPER_NOUNS = ['London', 'Paris', 'Google', 'Apple', 'Twitter', 'Netflix', 'Monday', 'Friday', 'Chelsea',
+                'Amazon', 'Tesla', 'India', 'Texas', 'Spotify', 'Samsung']
+VERBS = ['love', 'hate', 'buy', 'sell', 'watch', 'play', 'win', 'lose', 'miss', 'need', 'want', 'fix', 'break',
+         'update', 'cancel', 'book', 'visit', 'open', 'close', 'launch', 'release', 'support', 'drop', 'raise']
+ADJECTIVES = ['new', 'old', 'great', 'terrible', 'fast', 'slow', 'cheap', 'expensive', 'amazing', 'broken',
+              'huge', 'tiny', 'late', 'early', 'best', 'worst']
+TEMPLATES = ['The {adj} {noun} {verb}s the {noun2} in {proper}.',
+             'I {verb} my {adj} {noun} and the {noun2}!',
+             'Why does {proper} {verb} every {noun} {noun2}?',
+             'Just {verb}ed a {adj} {noun} from {proper} - {noun2} {noun} {noun2}.',
+             'Our {noun} {noun2} {verb}s {number} times a day.',
+             '{proper} {noun} {noun2} is so {adj} today.']
+
+
+def zipf_weights(size, exponent=1.1):
+    return [1.0 / (rank ** exponent) for rank in range(1, size + 1)]
+
+
+class CorpusGenerator:
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.cum_weights = {name: list(itertools.accumulate(zipf_weights(len(words))))
+                            for name, words in [('noun', NOUNS), ('proper', PROPER_NOUNS), ('verb', VERBS),
+                                                ('adj', ADJECTIVES)]}
+
+    def choice(self, name, words):
+        return self.rng.choices(words, cum_weights=self.cum_weights[name])[0]
+
+    def sentence(self):
+        template = self.rng.choice(TEMPLATES)
+        return template.format(adj=self.choice('adj', ADJECTIVES),
+                               noun=self.choice('noun', NOUNS),
+                               noun2=self.choice('noun', NOUNS),
+                               verb=self.choice('verb', VERBS),
+                               proper=self.choice('proper', PROPER_NOUNS),
+                               number=self.rng.randint(2, 99))
+
+    def hashtags(self):
+        count = self.rng.choices([0, 1, 2, 3], weights=[4, 3, 2, 1])[0]
+        return ['#' + self.choice('noun', NOUNS) for _ in range(count)]
+
+    def tweet(self):
+        parts = [self.sentence() for _ in range(self.rng.randint(1, 2))]
+        hashtags = self.hashtags()
+        if self.rng.random() < 0.3:
+            parts.insert(0, '@' + self.choice('proper', PROPER_NOUNS).lower())
+        if self.rng.random() < 0.2:
+            parts.append('https://t.co/{:x}'.format(self.rng.getrandbits(40)))
+        return ' '.join(parts + hashtags), hashtags
+
+
+def make_sentences(num_sentences, seed=0):
+    generator = CorpusGenerator(seed)
+    return [generator.sentence() for _ in range(num_sentences)]
+
+
+def make_tweets(num_tweets, seed=0):
+    """
+    Function to generate a tweets data-frame with the columns of get_tweets
+    """
+    generator = CorpusGenerator(seed)
+    start = datetime.datetime(2020, 1, 1)
+    rows = []
+    for i in range(num_tweets):
+        text, hashtags = generator.tweet()
+        posted = start + datetime.timedelta(minutes=generator.rng.randint(0, 60 * 24 * 365))
+        rows.append((10 ** 17 + i, 'user{}'.format(generator.rng.randint(1, 5000)), posted, text, hashtags))
+    return pd.DataFrame(rows, columns=['id', 'username', 'datetime', 'text', 'hashtags'])
+
+
+def write_tweets_jsonl(df_tweets, path):
+    """
+    Function to save a tweets data-frame as a replay file for NLP/tweet_sources.JsonlReplaySource
+    """
+    with open(path, 'w', encoding='utf-8') as file:
+        for row in df_tweets.itertuples(index=False):
+            file.write(json.dumps({'id': row.id, 'username': row.username, 'date': row.datetime.isoformat(),
+                                   'text': row.text, 'hashtags': row.hashtags}) + '\n')
+
+
+def make_documents(num_sentences, sentences_per_document=50, seed=0):
+    """
+    Function to generate uploaded documents - a data-frame with one 'data' row per document
+    """
+    sentences = make_sentences(num_sentences, seed)
+    documents = [' '.join(sentences[i:i + sentences_per_document])
+                 for i in range(0, len(sentences), sentences_per_document)]
+    return pd.DataFrame({'data': documents})
+
+
+def make_phrases(num_sentences, seed=0):
+    """
+    Function to generate already cleaned and phrased text, as produced by get_phrases
+    """
+    generator = CorpusGenerator(seed)
+    phrases = []
+    for _ in range(num_sentences):
+        words = [generator.choice('noun', NOUNS) for _ in range(generator.rng.randint(3, 8))]
+        words.insert(generator.rng.randint(0, len(words)), generator.choice('verb', VERBS))
+        phrases.append(' '.join(words))
+    return pd.DataFrame({'phrase': phrases})
@@ -0,0 +1,195 @@
+"""
+Run.py benchmarks the NLP pipeline on synthetic corpora (see corpus.py), offline.
+
+Every stage and full pipeline is measured in a fresh process, so peak RSS belongs to that measurement alone.
+Each measurement is printed as one JSON line with the wall time, throughput (sentences per second) and
+peak RSS, plus the git commit and python version, so results of different runs can be compared.
+
+Generated files (wordclouds, cache entries, topic models) go to a temporary directory and nothing is cached
+between measurements.
+
+Usage: python benchmarks/run.py [--sizes 1000,10000,100000,1000000] [--stages cleanup_texts,top_bigrams_tweets]
+                                [--repeats 3] [--output results.jsonl]
+The repository must be checked out as a directory named flaskblog.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from queue import Empty
+from datetime import datetime
+
+import corpus
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def setup_app(root_dir):
+    """
+    Function to point the app at a scratch directory and switch off result caching
+    """
+    sys.path.insert(0, os.path.dirname(PACKAGE_DIR))
+    from flaskblog import app
+
+    for directory in ['wordclouds', 'hashtags', 'twitter_timeline', 'lda_vis', 'text_files']:
+        os.makedirs(os.path.join(root_dir, 'static', directory), exist_ok=True)
+    app.root_path = root_dir
+    app.config['ANALYSIS_CACHE_MAX_BYTES'] = 0  # every entry is evicted right after it is written
+
+    # modules imported together with the app (through the routes) have bound their paths already
+    from flaskblog import artifacts, results, jobs, metrics
+    from flaskblog.NLP.cache import analysis_cache
+    artifacts.ARTIFACTS_DB = os.path.join(root_dir, 'artifacts.db')
+    artifacts.STATIC_DIR = os.path.join(root_dir, 'static')
+    results.RESULTS_DB = os.path.join(root_dir, 'results.db')
+    jobs.JOBS_DIR = os.path.join(root_dir, 'jobs')
+    metrics.METRICS_DB = os.path.join(root_dir, 'metrics.db')
+    analysis_cache.cache_dir = os.path.join(root_dir, 'cache')
+    analysis_cache.max_bytes = 0
+    os.makedirs(analysis_cache.cache_dir, exist_ok=True)
+    return app
+
+
+# each stage gets (size, seed) and returns (function to time, its input, number of sentences processed)
+def prepare_stage(stage, size, seed):
+    if stage == 'get_sentences_df':
+        from flaskblog.NLP.utils import get_sentences_df
+        return get_sentences_df, corpus.make_documents(size, seed=seed), size
+    if stage == 'normalize_texts':
+        from flaskblog.NLP.utils import normalize_texts
+        return normalize_texts, corpus.make_sentences(size, seed=seed), size
+    if stage == 'cleanup_text':
+        from flaskblog.NLP.utils import cleanup_text
+        return (lambda sentences: [cleanup_text(sentence) for sentence in sentences]), \
+            corpus.make_sentences(size, seed=seed), size
+    if stage == 'cleanup_texts':
+        from flaskblog.NLP.utils import cleanup_texts
+        return cleanup_texts, corpus.make_sentences(size, seed=seed), size
+    if stage == 'ingest_tweets':
+        from flaskblog import app
+        from flaskblog.NLP.tweet_sources import ingest_tweets, JsonlReplaySource
+        path = os.path.join(app.root_path, 'tweets.jsonl')
+        corpus.write_tweets_jsonl(corpus.make_tweets(size, seed=seed), path)
+        source = JsonlReplaySource(path)
+        return (lambda count: ingest_tweets('', count, datetime(2019, 1, 1).date(), datetime(2021, 1, 1).date(),
+                                            source=source)), size, size
+    if stage == 'analyze_tweets':
+        from flaskblog.NLP.tweet_analytics import analyze_tweets
+        return analyze_tweets, corpus.make_tweets(size, seed=seed), size
+    if stage == 'get_hashtags':
+        from flaskblog.NLP.twitter_data import get_hashtags
+        return get_hashtags, corpus.make_tweets(size, seed=seed), size
+    if stage == 'get_bigrams':
+        from flaskblog.NLP.utils import get_bigrams_and_words
+        from flaskblog.NLP.token_corpus import TokenCorpus
+        token_corpus = TokenCorpus.from_texts(corpus.make_phrases(size, seed=seed)['phrase'])
+        return (lambda data: get_bigrams_and_words(data, 300)), token_corpus, size
+    if stage == 'top_bigrams_tweets':
+        from flaskblog.NLP.process_text import run_top_bigrams
+        df_tweets = corpus.make_tweets(size, seed=seed)[['id', 'text']]
+        df_tweets.columns = ['id', 'data']
+        return run_top_bigrams, df_tweets, size
+    if stage == 'top_bigrams_upload':
+        from flaskblog.NLP.process_text import run_top_bigrams
+        df_data = corpus.make_documents(size, sentences_per_document=size, seed=seed)
+        return run_top_bigrams, df_data, size
+    if stage == 'main_topics':
+        from flaskblog.NLP.process_text import get_main_topics
+        return get_main_topics, corpus.make_phrases(size, seed=seed), size
+    raise ValueError('unknown stage {}'.format(stage))
+
+
+STAGES = ['get_sentences_df', 'normalize_texts', 'cleanup_text', 'cleanup_texts', 'ingest_tweets', 'get_hashtags',
+          'analyze_tweets', 'get_bigrams', 'top_bigrams_tweets', 'top_bigrams_upload', 'main_topics']
+
+
+def measure(stage, size, seed, queue):
+    """
+    Runs in a fresh process - prepares the input, then times the stage on it
+    """
+    root_dir = tempfile.mkdtemp(prefix='flaskblog-bench-')
+    try:
+        setup_app(root_dir)
+        function, data, num_sentences = prepare_stage(stage, size, seed)
+        baseline_rss = peak_rss_mb()
+
+        start = time.perf_counter()
+        function(data)
+        wall_seconds = time.perf_counter() - start
+
+        queue.put({'wall_seconds': wall_seconds,
+                   'throughput': num_sentences / wall_seconds if wall_seconds else None,
+                   'baseline_rss_mb': baseline_rss,
+                   'peak_rss_mb': peak_rss_mb()})
+    finally:
+        shutil.rmtree(root_dir, ignore_errors=True)
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PACKAGE_DIR, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000', help='comma separated numbers of sentences')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='comma separated stages, from: ' + ', '.join(STAGES))
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--output', help='file to append the JSON lines to (default: stdout)')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    stages = args.stages.split(',')
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error('unknown stage {}'.format(stage))
+
+    context = multiprocessing.get_context('spawn')
+    run_info = {'git_commit': get_git_commit(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpu_count': os.cpu_count(),
+                'started': datetime.utcnow().isoformat()}
+    output = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        for stage in stages:
+            for size in sizes:
+                for repeat in range(args.repeats):
+                    queue = context.Queue()
+                    process = context.Process(target=measure, args=(stage, size, repeat, queue))
+                    process.start()
+                    result = None
+                    while result is None and (process.is_alive() or not queue.empty()):
+                        try:
+                            result = queue.get(timeout=1)
+                        except Empty:
+                            pass
+                    process.join()
+                    if result is None:
+                        result = {'error': 'exit code {}'.format(process.exitcode)}
+
+                    record = dict(run_info, benchmark=stage, size=size, repeat=repeat, **result)
+                    output.write(json.dumps(record) + '\n')
+                    output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Startup.py measures how long `import flaskblog` takes and how much memory it uses, and checks both against
+the startup budget of the web workers. The blog routes must not pull in the NLP stack, so the check also fails
+if any of the heavy NLP libraries got imported.
+
+Usage: python benchmarks/startup.py [--max-seconds 2.0] [--max-rss-mb 150]
+Prints the measurement as JSON and exits with status 1 if the budget is exceeded.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+import tempfile
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# libraries that must only be imported by the analysis routes
+HEAVY_MODULES = ['spacy', 'gensim', 'nltk', 'sklearn', 'pyLDAvis', 'wordcloud', 'matplotlib', 'GetOldTweets3']
+
+MEASURE_CODE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import flaskblog
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds,
+                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'heavy_modules': [name for name in %r if name in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure_startup():
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(PACKAGE_DIR))
+    env.pop('NLP_WARM_UP', None)
+    with tempfile.TemporaryDirectory() as work_dir:  # keeps session files etc. out of the source tree
+        output = subprocess.run([sys.executable, '-c', MEASURE_CODE], env=env, cwd=work_dir, check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-seconds', type=float, default=2.0)
+    parser.add_argument('--max-rss-mb', type=float, default=150.0)
+    args = parser.parse_args()
+
+    result = measure_startup()
+    result['budget'] = {'seconds': args.max_seconds, 'rss_mb': args.max_rss_mb}
+    result['ok'] = (result['seconds'] <= args.max_seconds and result['rss_mb'] <= args.max_rss_mb
+                    and not result['heavy_modules'])
+    print(json.dumps(result, indent=2))
+    return 0 if result['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
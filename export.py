@@ -0,0 +1,130 @@
+"""
+Export.py module streams the downloads of the analysis results in chunks of rows, so a download starts right
+away and never holds the whole file in memory.
+
+Results are read from the result store chunk by chunk (results.iter_result); data-frames that only exist in
+memory (e.g. the output of a background job) are cut into chunks as well.
+
+Formats:
+    csv     - plain CSV
+    csv.gz  - gzip compressed CSV
+    parquet - columnar Parquet, one row group per chunk (needs pyarrow)
+"""
+import zlib
+from flask import Response
+from flaskblog import app
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # parquet exports are only offered with pyarrow installed
+    pa = None
+    pq = None
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'csv.gz': ('application/gzip', 'csv.gz'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def get_export_format(fmt):
+    """
+    Function to check a requested export format
+    Output: the format, None if it is unknown or not available
+    """
+    fmt = fmt or 'csv'
+    if fmt not in EXPORT_FORMATS or (fmt == 'parquet' and pq is None):
+        return None
+    return fmt
+
+
+def iter_frame_chunks(df, chunk_rows=None):
+    chunk_rows = chunk_rows or app.config['EXPORT_CHUNK_ROWS']
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def iter_csv(chunks):
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header, sep=",").encode('utf-8')
+        header = False
+
+
+def iter_gzip(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # 16 + ... writes the gzip format
+    for block in data:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class ChunkSink:
+    """
+    Write-only file the Parquet writer writes to - the bytes written so far are taken out after each row group
+    """
+    def __init__(self):
+        self.blocks = []
+        self.closed = False
+
+    def write(self, data):
+        self.blocks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.blocks)
+        self.blocks = []
+        return data
+
+
+def get_parquet_type(data_type):
+    if pa.types.is_null(data_type):
+        return pa.string()
+    if pa.types.is_list(data_type):
+        return pa.list_(get_parquet_type(data_type.value_type))
+    return data_type
+
+
+def iter_parquet(chunks):
+    sink = ChunkSink()
+    writer = None
+    schema = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+        if writer is None:
+            # columns without any value in the first chunk are written as strings
+            schema = pa.schema([pa.field(field.name, get_parquet_type(field.type)) for field in table.schema])
+            table = table.cast(schema)
+            writer = pq.ParquetWriter(sink, schema)
+        writer.write_table(table)
+        yield sink.take()
+    if writer is not None:
+        writer.close()
+        yield sink.take()
+
+
+def send_export(chunks, f_name, fmt='csv'):
+    """
+    Function to stream chunks of a result as a download
+    Input: iterable of data-frames, name of the file without extension, export format (see get_export_format)
+    Output: streamed response
+    """
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    if fmt == 'parquet':
+        data = iter_parquet(chunks)
+    elif fmt == 'csv.gz':
+        data = iter_gzip(iter_csv(chunks))
+    else:
+        data = iter_csv(chunks)
+
+    response = Response(data, mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(f_name, extension)
+    return response
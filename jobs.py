@@ -0,0 +1,244 @@
+"""
+Jobs.py module runs the slow NLP analyses on a process pool instead of inside the request.
+
+Every job gets a directory under jobs/ holding its status (status.json) and, once it has finished,
+its pickled result (result.pkl). Because the state lives on disk, any web worker can answer status
+and result requests, not just the one that submitted the job. Job directories are deleted
+app.config['JOB_TTL_SECONDS'] after their last status update.
+
+The pool processes are started from a forkserver rather than forked from the (threaded) web worker, so they
+don't inherit locks held by its other threads or background threads that don't exist in the child.
+"""
+import os
+import re
+import json
+import pickle
+import time
+import shutil
+import secrets
+import threading
+import traceback
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flaskblog import app
+from flaskblog.NLP.loader import lazy_function
+
+# imported by the pool process on the first job, not by the web worker
+run_top_bigrams = lazy_function('flaskblog.NLP.process_text', 'run_top_bigrams')
+run_top_bigrams_file = lazy_function('flaskblog.NLP.process_text', 'run_top_bigrams_file')
+get_main_topics = lazy_function('flaskblog.NLP.process_text', 'get_main_topics')
+update_phrase_models = lazy_function('flaskblog.NLP.phrase_models', 'update_phrase_models')
+
+JOBS_DIR = os.path.join(app.root_path, 'jobs')
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+job_id_pattern = re.compile(r'^[0-9a-f]{16}$')
+
+executor = None
+executor_lock = threading.Lock()
+in_job_process = False
+last_sweep = 0.0
+
+
+def init_job_process():
+    global in_job_process
+    in_job_process = True
+
+
+def is_job_process():
+    """
+    Function to check if the code runs inside one of the job pool processes rather than in a web worker
+    """
+    return in_job_process
+
+
+def get_executor():
+    """
+    Function to create the process pool on first use, so workers that never submit a job don't fork
+    """
+    global executor
+    with executor_lock:
+        if executor is None:
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            executor = ProcessPoolExecutor(max_workers=app.config['JOB_WORKERS'],
+                                           mp_context=multiprocessing.get_context(start_method),
+                                           initializer=init_job_process)
+        return executor
+
+
+def reset_executor(broken):
+    """
+    Function to drop a broken pool (one of its processes died) so the next job starts a new one
+    """
+    global executor
+    with executor_lock:
+        if executor is broken:
+            executor = None
+    broken.shutdown(wait=False)
+
+
+def get_job_dir(job_id):
+    if not job_id_pattern.match(str(job_id)):
+        return None
+    return os.path.join(JOBS_DIR, job_id)
+
+
+def write_status(job_id, **fields):
+    job_dir = get_job_dir(job_id)
+    status_path = os.path.join(job_dir, 'status.json')
+    status = read_status(job_id) or {}
+    status.update(fields)
+    status['job_id'] = job_id
+    status['updated'] = datetime.utcnow().isoformat()
+
+    # write to a temp file and rename so readers never see a half written status
+    tmp_path = status_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(status, file)
+    os.replace(tmp_path, status_path)
+
+
+def read_status(job_id):
+    job_dir = get_job_dir(job_id)
+    if job_dir is None:
+        return None
+    status_path = os.path.join(job_dir, 'status.json')
+    if not os.path.exists(status_path):
+        return None
+    with open(status_path) as file:
+        return json.load(file)
+
+
+def submit_job(kind, user_id, *args):
+    """
+    Function to queue a job on the process pool
+    Input: kind of job (one of job_functions), id of the user submitting it, arguments for the job function
+    Output: job id
+    """
+    job_id = secrets.token_hex(8)
+    os.makedirs(get_job_dir(job_id), exist_ok=True)
+    write_status(job_id, kind=kind, user_id=user_id, status=PENDING, created=datetime.utcnow().isoformat())
+
+    pool = get_executor()
+    try:
+        future = pool.submit(run_job, job_id, kind, *args)
+    except BrokenProcessPool:
+        reset_executor(pool)
+        pool = get_executor()
+        future = pool.submit(run_job, job_id, kind, *args)
+    future.add_done_callback(lambda done: check_job_process(job_id, pool, done))
+
+    if time.time() - last_sweep >= app.config['JOB_SWEEP_INTERVAL_SECONDS']:
+        sweep_jobs()
+    return job_id
+
+
+def check_job_process(job_id, pool, future):
+    """
+    Runs in the submitting process once a job's future is done - run_job records its own errors, so an
+    exception here means the pool process died (e.g. killed for using too much memory) and the job would
+    otherwise stay running forever
+    """
+    error = future.exception() if not future.cancelled() else None
+    if error is None:
+        return
+    write_status(job_id, status=FAILED, error=str(error) or type(error).__name__)
+    if isinstance(error, BrokenProcessPool):
+        reset_executor(pool)
+
+
+def sweep_jobs():
+    """
+    Function to delete the directories of the jobs whose status hasn't changed for app.config['JOB_TTL_SECONDS']
+    """
+    global last_sweep
+    last_sweep = time.time()
+    expired = last_sweep - app.config['JOB_TTL_SECONDS']
+
+    try:
+        entries = list(os.scandir(JOBS_DIR))
+    except OSError:
+        return
+    for entry in entries:
+        if not job_id_pattern.match(entry.name):
+            continue
+        try:
+            if os.stat(os.path.join(entry.path, 'status.json')).st_mtime >= expired:
+                continue
+        except OSError:
+            if entry.stat().st_mtime >= expired:
+                continue  # being created
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def run_job(job_id, kind, *args):
+    """
+    Runs inside a pool process - executes the job function and saves its result to disk
+    """
+    write_status(job_id, status=RUNNING)
+    try:
+        result = job_functions[kind](*args)
+        result_path = os.path.join(get_job_dir(job_id), 'result.pkl')
+        with open(result_path + '.tmp', 'wb') as file:
+            pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(result_path + '.tmp', result_path)
+        write_status(job_id, status=DONE)
+    except Exception as e:
+        traceback.print_exc()
+        write_status(job_id, status=FAILED, error=str(e))
+
+
+def get_job(job_id, user_id):
+    """
+    Function to get the status of a job, only if it belongs to the user
+    """
+    status = read_status(job_id)
+    if status is None or status.get('user_id') != user_id:
+        return None
+    return status
+
+
+def get_job_result(job_id, user_id):
+    """
+    Function to load the result of a finished job
+    Output: result of the job function, None if the job is unknown, not finished or failed
+    """
+    status = get_job(job_id, user_id)
+    if status is None or status['status'] != DONE:
+        return None
+    with open(os.path.join(get_job_dir(job_id), 'result.pkl'), 'rb') as file:
+        return pickle.load(file)
+
+
+def top_bigrams_job(df, user_id):
+    df_bigrams, df_phrases, wc_filename = run_top_bigrams(df, user_id)
+    return {'bigrams': df_bigrams, 'phrases': df_phrases, 'wc_filename': wc_filename}
+
+
+def top_bigrams_file_job(file_name, user_id, content_hash=None):
+    # the phrases of an upload go to the result store rather than into the pickled job result
+    df_bigrams, phrases_id, wc_filename = run_top_bigrams_file(file_name, user_id, content_hash)
+    return {'bigrams': df_bigrams, 'phrases_id': phrases_id, 'wc_filename': wc_filename}
+
+
+def topics_job(df_phrases, user_id=None):
+    df_topics, vis_filename = get_main_topics(df_phrases, user_id)
+    return {'topics': df_topics, 'vis_filename': vis_filename}
+
+
+def phrase_update_job(scope):
+    update_phrase_models(scope)
+
+
+job_functions = {
+    'top_bigrams': top_bigrams_job,
+    'top_bigrams_file': top_bigrams_file_job,
+    'topics': topics_job,
+    'phrase_update': phrase_update_job,
+}
@@ -0,0 +1,176 @@
+"""
+Metrics.py module records how long each stage of the NLP pipelines takes, how many rows go in and out and how
+much the process memory changes, and renders everything in the Prometheus text format for the /metrics route.
+
+Metrics are kept in metrics.db (SQLite), so /metrics reports the stages of every process - web workers, job
+processes and their shard workers - not just the one answering the request. With app.config['METRICS_LOG_STAGES']
+set, every request that ran pipeline stages also logs a per-stage breakdown.
+"""
+import os
+import time
+import math
+import sqlite3
+import resource
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+from flaskblog import app
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, math.inf)
+MEMORY_BUCKETS = tuple(mb * 1024 * 1024 for mb in (-64, -8, 0, 1, 8, 32, 64, 128, 256, 512, 1024)) + (math.inf,)
+ROWS_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000, math.inf)
+
+METRICS_DB = os.path.join(app.root_path, 'metrics.db')
+
+# histogram name -> buckets, each histogram has one series per (pipeline, stage)
+histograms = {
+    'nlp_stage_seconds': SECONDS_BUCKETS,
+    'nlp_stage_memory_delta_bytes': MEMORY_BUCKETS,
+    'nlp_stage_rows_in': ROWS_BUCKETS,
+    'nlp_stage_rows_out': ROWS_BUCKETS,
+}
+
+
+def get_connection():
+    conn = sqlite3.connect(METRICS_DB, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')  # readers don't block the writer
+    conn.execute('CREATE TABLE IF NOT EXISTS histogram_buckets ('
+                 'name TEXT NOT NULL, pipeline TEXT NOT NULL, stage TEXT NOT NULL, bucket INTEGER NOT NULL, '
+                 'count INTEGER NOT NULL, PRIMARY KEY (name, pipeline, stage, bucket))')
+    conn.execute('CREATE TABLE IF NOT EXISTS histogram_sums ('
+                 'name TEXT NOT NULL, pipeline TEXT NOT NULL, stage TEXT NOT NULL, sum REAL NOT NULL, '
+                 'count INTEGER NOT NULL, PRIMARY KEY (name, pipeline, stage))')
+    conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+    return conn
+
+
+def get_rss_bytes():
+    """
+    Function to get the current resident memory of the process (peak memory where /proc is not available)
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def observe(observations):
+    """
+    Function to add observations to the histograms in one transaction
+    Input: list of (histogram name, (pipeline, stage), value)
+    """
+    try:
+        with get_connection() as conn:
+            for name, (pipeline, stage), value in observations:
+                bucket = next(i for i, bound in enumerate(histograms[name]) if value <= bound)
+                conn.execute('INSERT INTO histogram_buckets VALUES (?, ?, ?, ?, 1) '
+                             'ON CONFLICT (name, pipeline, stage, bucket) DO UPDATE SET count = count + 1',
+                             (name, pipeline, stage, bucket))
+                conn.execute('INSERT INTO histogram_sums VALUES (?, ?, ?, ?, 1) '
+                             'ON CONFLICT (name, pipeline, stage) DO UPDATE SET sum = sum + excluded.sum, '
+                             'count = count + 1', (name, pipeline, stage, value))
+    except sqlite3.Error:
+        app.logger.exception('could not record stage metrics')
+
+
+def increment(name, value=1):
+    """
+    Function to add to a counter shared by all processes
+    """
+    try:
+        with get_connection() as conn:
+            conn.execute('INSERT INTO counters VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + ?',
+                         (name, value, value))
+    except sqlite3.Error:
+        app.logger.exception('could not record counter %s', name)
+
+
+class StageRecord:
+    def __init__(self, pipeline, stage, rows_in):
+        self.pipeline = pipeline
+        self.stage = stage
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.seconds = None
+        self.memory_delta = None
+
+
+@contextmanager
+def timed_stage(pipeline, stage, rows_in=None):
+    """
+    Context manager to measure one pipeline stage - set rows_out on the yielded record inside the block
+    Usage:
+        with timed_stage('top_bigrams', 'cleanup', rows_in=len(df)) as record:
+            ...
+            record.rows_out = len(result)
+    """
+    record = StageRecord(pipeline, stage, rows_in)
+    rss_before = get_rss_bytes()
+    start = time.perf_counter()
+    yield record
+    record.seconds = time.perf_counter() - start
+    record.memory_delta = get_rss_bytes() - rss_before
+
+    labels = (pipeline, stage)
+    observations = [('nlp_stage_seconds', labels, record.seconds),
+                    ('nlp_stage_memory_delta_bytes', labels, record.memory_delta)]
+    if record.rows_in is not None:
+        observations.append(('nlp_stage_rows_in', labels, record.rows_in))
+    if record.rows_out is not None:
+        observations.append(('nlp_stage_rows_out', labels, record.rows_out))
+    observe(observations)
+
+    if has_request_context():
+        if 'nlp_stages' not in g:
+            g.nlp_stages = []
+        g.nlp_stages.append(record)
+
+
+def format_bound(bound):
+    return '+Inf' if bound == math.inf else repr(float(bound))
+
+
+def render_metrics():
+    """
+    Function to render all histograms and counters, of all processes, in the Prometheus text format
+    """
+    with get_connection() as conn:
+        bucket_rows = conn.execute('SELECT name, pipeline, stage, bucket, count FROM histogram_buckets').fetchall()
+        sum_rows = conn.execute('SELECT name, pipeline, stage, sum, count FROM histogram_sums').fetchall()
+        counters = conn.execute('SELECT name, value FROM counters ORDER BY name').fetchall()
+
+    bucket_counts = {}
+    for name, pipeline, stage, bucket, count in bucket_rows:
+        bucket_counts[(name, pipeline, stage, bucket)] = count
+    series = {name: [] for name in histograms}
+    for name, pipeline, stage, total, count in sum_rows:
+        if name in series:
+            series[name].append((pipeline, stage, total, count))
+
+    lines = []
+    for name, buckets in histograms.items():
+        lines.append('# TYPE {} histogram'.format(name))
+        for pipeline, stage, total, count in sorted(series[name]):
+            labels = 'pipeline="{}",stage="{}"'.format(pipeline, stage)
+            cumulative = 0
+            for i, bound in enumerate(buckets):
+                cumulative += bucket_counts.get((name, pipeline, stage, i), 0)
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, format_bound(bound), cumulative))
+            lines.append('{}_sum{{{}}} {}'.format(name, labels, total))
+            lines.append('{}_count{{{}}} {}'.format(name, labels, count))
+
+    for name, value in counters:
+        lines.append('# TYPE {} counter'.format(name))
+        lines.append('{} {}'.format(name, value))
+
+    return '\n'.join(lines) + '\n'
+
+
+@app.after_request
+def log_stage_breakdown(response):
+    if app.config['METRICS_LOG_STAGES'] and g.get('nlp_stages'):
+        breakdown = ', '.join('{}.{}: {:.3f}s rows {}->{} mem {:+.1f}MB'.format(
+            record.pipeline, record.stage, record.seconds, record.rows_in, record.rows_out,
+            record.memory_delta / (1024 * 1024)) for record in g.nlp_stages)
+        app.logger.info('%s %s stages: %s', request.method, request.path, breakdown)
+    return response
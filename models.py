@@ -9,6 +9,52 @@ def load_user(user_id):  # function to get user details given the user ID
     return User.query.get(int(user_id))
 
 
+def upgrade_database():
+    """
+    Function to add columns and indexes declared on the models to tables created before they existed
+    (db.create_all() only creates missing tables, not missing columns or indexes)
+    """
+    inspector = db.inspect(db.engine)
+    existing_tables = inspector.get_table_names()
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue  # db.create_all() creates the table together with its columns and indexes
+
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                db.session.execute('ALTER TABLE "{}" ADD COLUMN {} {}'.format(table.name, column.name, column_type))
+
+        for index in table.indexes:
+            columns = ', '.join(column.name for column in index.columns)
+            db.session.execute('CREATE INDEX IF NOT EXISTS {} ON "{}" ({})'.format(index.name, table.name, columns))
+    db.session.commit()
+
+
+def get_keyset_page(query, date_column, id_column, after, per_page):
+    """
+    Function to get one page of a query, newest first by (date, id) - rows without a date come last, by id
+    Input: query, date and id columns, (date, id) key of the last row of the previous page (the date may be None),
+           number of rows per page
+    Output: list of rows, (date, id) key of the last row if there are more rows, else None
+    """
+    if after is not None:
+        date_posted, row_id = after
+        if date_posted is None:
+            query = query.filter(date_column.is_(None), id_column < row_id)
+        else:
+            query = query.filter(db.or_(date_column < date_posted,
+                                        db.and_(date_column == date_posted, id_column < row_id),
+                                        date_column.is_(None)))
+    rows = query.order_by(date_column.desc().nullslast(), id_column.desc()).limit(per_page + 1).all()
+
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        return rows, (getattr(rows[-1], date_column.key), getattr(rows[-1], id_column.key))
+    return rows, None
+
+
 # ---------- CONTAINS DEFINITION OF ALL DATABASE MODELS IN THE PROJECT --------------------- #
 
 class User(db.Model, UserMixin):
@@ -32,7 +78,10 @@ class Post(db.Model):
     date_posted = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)  # not using utcnow() as this will
     # set the value to the current time for all objects
     content = db.Column(db.Text, nullable=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+
+    # serves the keyset pagination of the post feed (newest first)
+    __table_args__ = (db.Index('ix_post_date_posted_id', 'date_posted', 'id'),)
 
     # "user" is the table name. In SQLAlchemy, tables are created for each of these classes with their table names
     # set to class names in lower case, user.id is the id column in the user table
@@ -40,14 +89,43 @@ class Post(db.Model):
     def __repr__(self):
         return "Post('{}', '{}', '{}')".format(self.title, self.user_id, self.date_posted)
 
+    @staticmethod
+    def get_feed_page(after=None, per_page=10):
+        """
+        Function to get one page of the post feed, newest first, with the authors loaded in the same query
+        Input: (date_posted, id) of the last post of the previous page, number of posts per page
+        Output: list of posts, (date_posted, id) key of the last post if there are more posts, else None
+        """
+        query = Post.query.options(db.joinedload(Post.author))
+        return get_keyset_page(query, Post.date_posted, Post.id, after, per_page)
+
 
 class FileUpload(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    text_file = db.Column(db.String(30), nullable=False)
+    text_file = db.Column(db.String(80), nullable=False)  # stored as <content_hash><ext>, shared by equal uploads
     date_posted = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)  # not using utcnow() as this will
     # set the value to the current time for all objects
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # sha256 of the file, None for old uploads
+    file_size = db.Column(db.Integer, nullable=True)
+
+    # serves the latest-upload lookup and the upload history of a user
+    __table_args__ = (db.Index('ix_file_upload_user_id_date_posted', 'user_id', 'date_posted'),)
 
     def __repr__(self):
         return "File('{}', '{}', '{}')".format(self.user_id, self.text_file, self.date_posted)
 
+    @staticmethod
+    def get_latest(user_id):
+        return FileUpload.query.filter_by(user_id=user_id) \
+            .order_by(FileUpload.date_posted.desc(), FileUpload.id.desc()).first()
+
+    @staticmethod
+    def get_history_page(user_id, after=None, per_page=20):
+        """
+        Function to get one page of a user's uploads, newest first
+        Input: user id, (date_posted, id) of the last upload of the previous page, number of uploads per page
+        Output: list of uploads, (date_posted, id) key of the last upload if there are more uploads, else None
+        """
+        query = FileUpload.query.filter_by(user_id=user_id)
+        return get_keyset_page(query, FileUpload.date_posted, FileUpload.id, after, per_page)
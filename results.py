@@ -0,0 +1,210 @@
+"""
+Results.py module stores the data-frames produced by the analyses in a SQLite database (results.db),
+one table per result, so that only a small reference has to be kept in the user's session.
+
+Results are loaded lazily - a route reads only the columns / rows it needs, and requests that don't need
+any result don't pay for deserializing it.
+"""
+import os
+import json
+import secrets
+import sqlite3
+from datetime import datetime
+import pandas as pd
+from flask import session
+from flask_login import current_user
+from flaskblog import app
+
+RESULTS_DB = os.path.join(app.root_path, 'results.db')
+
+
+def get_connection():
+    conn = sqlite3.connect(RESULTS_DB, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')  # readers don't block the writer
+    conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                 'analysis_id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, name TEXT NOT NULL, '
+                 'num_rows INTEGER NOT NULL, columns TEXT NOT NULL, created TEXT NOT NULL)')
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_results_user_name ON results (user_id, name)')
+    return conn
+
+
+def quote(name):
+    return '"{}"'.format(str(name).replace('"', '""'))
+
+
+def get_table(analysis_id):
+    return quote('result_{}'.format(analysis_id))
+
+
+def encode_columns(df):
+    """
+    Function to turn the column types that SQLite can't hold natively into text
+    Output: encoded data-frame, column types to restore them on load
+    """
+    df = df.copy()
+
+    # remember column types that SQLite can't hold natively, so they can be restored on load
+    columns = {}
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            columns[str(column)] = 'datetime'
+        elif df[column].map(lambda value: isinstance(value, (list, dict))).any():
+            columns[str(column)] = 'json'
+            df[column] = df[column].map(json.dumps)
+        else:
+            columns[str(column)] = 'plain'
+    df.columns = [str(column) for column in df.columns]
+    return df, columns
+
+
+def save_result(user_id, name, df):
+    """
+    Function to store a data-frame for a user
+    Input: user id, name of the result (e.g. 'tweets'), data-frame
+    Output: analysis id referencing the stored result
+    """
+    return save_result_chunks(user_id, name, [df])
+
+
+def save_result_chunks(user_id, name, chunks):
+    """
+    Function to store a data-frame that comes in chunks of rows, holding only one chunk in memory at a time
+    Input: user id, name of the result, iterable of data-frames with the same columns (at least one, may be empty)
+    Output: analysis id referencing the stored result
+    """
+    analysis_id = secrets.token_hex(8)
+    num_rows = 0
+    columns = None
+
+    with get_connection() as conn:
+        for chunk in chunks:
+            chunk, chunk_columns = encode_columns(chunk)
+            columns = columns or chunk_columns
+            chunk.to_sql('result_{}'.format(analysis_id), conn, index=False, if_exists='append')
+            num_rows += len(chunk)
+        conn.execute('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                     (analysis_id, user_id, name, num_rows, json.dumps(columns), datetime.utcnow().isoformat()))
+    return analysis_id
+
+
+def get_result_info(user_id, analysis_id):
+    """
+    Function to get the catalog entry of a result, only if it belongs to the user
+    """
+    with get_connection() as conn:
+        row = conn.execute('SELECT num_rows, columns FROM results WHERE analysis_id = ? AND user_id = ?',
+                           (analysis_id, user_id)).fetchone()
+    if row is None:
+        return None
+    return {'num_rows': row[0], 'columns': json.loads(row[1])}
+
+
+def load_result(user_id, analysis_id, columns=None, offset=0, limit=None):
+    """
+    Function to load a stored result
+    Input: user id, analysis id, columns to load (None for all), first row and number of rows to load
+    Output: data-frame, empty if the result doesn't exist
+    """
+    info = get_result_info(user_id, analysis_id)
+    if info is None:
+        return pd.DataFrame()
+
+    column_types = info['columns']
+    columns = list(column_types) if columns is None else [column for column in columns if column in column_types]
+    if not columns:
+        return pd.DataFrame()
+    query = 'SELECT {} FROM {} LIMIT ? OFFSET ?'.format(', '.join(quote(column) for column in columns),
+                                                        get_table(analysis_id))
+    with get_connection() as conn:
+        df = pd.read_sql_query(query, conn, params=(-1 if limit is None else limit, offset))
+
+    return decode_columns(df, column_types)
+
+
+def decode_columns(df, column_types):
+    """
+    Function to restore the column types SQLite can't hold natively
+    """
+    for column in df.columns:
+        if column_types[column] == 'datetime':
+            df[column] = pd.to_datetime(df[column])
+        elif column_types[column] == 'json':
+            df[column] = df[column].map(json.loads)
+    return df
+
+
+def iter_result(user_id, analysis_id, columns=None, chunk_rows=None):
+    """
+    Function to read a stored result in chunks of rows, holding only one chunk in memory at a time
+    Input: user id, analysis id, columns to load (None for all), rows per chunk (default app.config)
+    Output: generator of data-frames, nothing if the result doesn't exist
+    """
+    chunk_rows = chunk_rows or app.config['EXPORT_CHUNK_ROWS']
+    info = get_result_info(user_id, analysis_id)
+    if info is None:
+        return
+
+    column_types = info['columns']
+    columns = list(column_types) if columns is None else [column for column in columns if column in column_types]
+    if not columns:
+        return
+    query = 'SELECT {} FROM {}'.format(', '.join(quote(column) for column in columns), get_table(analysis_id))
+    conn = get_connection()
+    try:
+        for df in pd.read_sql_query(query, conn, chunksize=chunk_rows):
+            yield decode_columns(df, column_types)
+    finally:
+        conn.close()
+
+
+def delete_result(user_id, analysis_id):
+    if get_result_info(user_id, analysis_id) is None:
+        return
+    with get_connection() as conn:
+        conn.execute('DROP TABLE IF EXISTS {}'.format(get_table(analysis_id)))
+        conn.execute('DELETE FROM results WHERE analysis_id = ?', (analysis_id,))
+
+
+# ------------- helpers for the routes - keep only the analysis id in the session ------------- #
+
+def store_session_result(name, df):
+    """
+    Function to store a result of the current user and keep its reference in the session,
+    replacing the user's previous result with the same name
+    """
+    set_session_result(name, save_result(current_user.id, name, df))
+
+
+def set_session_result(name, analysis_id):
+    """
+    Function to keep the reference of an already stored result of the current user in the session,
+    replacing the user's previous result with the same name
+    """
+    key = 'result_{}'.format(name)
+    if key in session and session[key] != analysis_id:
+        delete_result(current_user.id, session[key])
+    session[key] = analysis_id
+
+
+def load_session_result(name, columns=None, offset=0, limit=None):
+    analysis_id = session.get('result_{}'.format(name))
+    if analysis_id is None:
+        return pd.DataFrame()
+    return load_result(current_user.id, analysis_id, columns=columns, offset=offset, limit=limit)
+
+
+def iter_session_result(name, columns=None, chunk_rows=None):
+    """
+    Function to read a result of the current user in chunks - the reference is looked up right away, so the
+    chunks can be read after the request context is gone (e.g. while a response is streamed)
+    """
+    analysis_id = session.get('result_{}'.format(name))
+    if analysis_id is None:
+        return iter(())
+    return iter_result(current_user.id, analysis_id, columns=columns, chunk_rows=chunk_rows)
+
+
+def count_session_result(name):
+    analysis_id = session.get('result_{}'.format(name))
+    info = get_result_info(current_user.id, analysis_id) if analysis_id else None
+    return info['num_rows'] if info else 0
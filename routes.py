@@ -1,19 +1,75 @@
-from pathlib import Path
-
-import io
-from flask import render_template, url_for, flash, redirect, request, abort, session, send_file
+import os
+import mimetypes
+from flask import render_template, url_for, flash, redirect, request, abort, session, jsonify
 from flaskblog import app, db, bcrypt
-from flaskblog.NLP.process_text import *
-from flaskblog.NLP.twitter_data import get_tweets, get_hashtags, get_tweet_year_month
-from flaskblog.utils import save_text_file, save_picture, get_file_contents, get_dataframe, get_download_csv
+from flaskblog.NLP.loader import lazy_function
+from flaskblog.utils import save_text_file, save_picture, get_file_contents, get_dataframe, get_file_path, \
+    encode_cursor, decode_cursor
 from flaskblog.forms import RegistrationForm, LoginForm, UpdateAccountForm, PostForm, TextFileUploadForm, TwitterForm
-from flaskblog.models import User, Post, FileUpload
+from flaskblog.models import User, Post, FileUpload, upgrade_database
+from flaskblog.jobs import submit_job, get_job, get_job_result, DONE, FAILED
+from flaskblog.results import store_session_result, load_session_result, iter_session_result, count_session_result, \
+    load_result, set_session_result
+from flaskblog.export import get_export_format, iter_frame_chunks, send_export
+from flaskblog.metrics import render_metrics
+from flaskblog.artifacts import register_artifact, get_artifact_path, send_artifact, send_gzip_artifact
 from flask_login import login_user, current_user, logout_user, login_required
-import pandas as pd
+
+# the NLP stack is only imported when one of the analysis routes is first used
+get_top_bigrams = lazy_function('flaskblog.NLP.process_text', 'get_top_bigrams')
+get_top_bigrams_file = lazy_function('flaskblog.NLP.process_text', 'get_top_bigrams_file')
+get_main_topics = lazy_function('flaskblog.NLP.process_text', 'get_main_topics')
+save_barplot = lazy_function('flaskblog.NLP.charts', 'save_barplot')
+save_lineplot = lazy_function('flaskblog.NLP.charts', 'save_lineplot')
+get_chart_file = lazy_function('flaskblog.NLP.charts', 'get_chart_file')
+get_tweets = lazy_function('flaskblog.NLP.twitter_data', 'get_tweets')
+analyze_tweets = lazy_function('flaskblog.NLP.tweet_analytics', 'analyze_tweets')
+get_timeline_axis_label = lazy_function('flaskblog.NLP.tweet_analytics', 'get_timeline_axis_label')
 
 
 # --------- CONTAINS ROUTE INFO FOR THE COMPLETE WEBSITE ------------ #
 
+# pages the job wait page goes on to once the job has finished
+JOB_RESULT_VIEWS = ('top_n_grams_result', 'download_topics', 'top_bigrams_tweets_result', 'topics_tweets_result')
+
+
+def get_job_output(kind, source, field):
+    """
+    Function to get part of the result of the user's latest background job of a kind for a source
+    Output: the requested field, None if there is no finished job
+    """
+    job_id = session.get('{}_job_{}'.format(kind, source))
+    result = get_job_result(job_id, current_user.id) if job_id else None
+    return result.get(field) if result is not None else None
+
+
+def use_top_bigrams_job(source):
+    """
+    Function to make the results of the user's latest phrase job for a source the current ones, like the inline
+    analysis does (the wordcloud, and the phrases for the topic model)
+    Output: top bigrams data-frame, None if there is no finished job
+    """
+    job_id = session.get('top_bigrams_job_{}'.format(source))
+    result = get_job_result(job_id, current_user.id) if job_id else None
+    if result is None:
+        return None
+    session['wc_filename'] = result['wc_filename']
+    if result.get('phrases_id') is not None:
+        # the stored phrases of an upload job become the user's current phrases
+        set_session_result('phrases', result['phrases_id'])
+    return result['bigrams']
+
+
+def send_download(chunks, f_name):
+    """
+    Function to stream a download in the format asked for with ?format= (csv, csv.gz or parquet, default csv)
+    Input: iterable of data-frames, name of the file without extension
+    """
+    fmt = get_export_format(request.values.get('format'))
+    if fmt is None:
+        abort(400)
+    return send_export(chunks, f_name, fmt)
+
 
 @app.route("/")
 @app.route("/home")
@@ -25,8 +81,46 @@ def home():
 @app.route("/")
 @app.route("/all_posts")
 def all_posts():
-    posts = list(Post.query.all())  # get all posts from DB
-    return render_template('all_posts.html', posts=posts)
+    # the cursor points at the last post of the previous page
+    cursor = request.args.get('cursor')
+    after = decode_cursor(cursor) if cursor else None
+    if cursor and after is None:
+        abort(400)
+
+    posts, last_key = Post.get_feed_page(after=after, per_page=app.config['POSTS_PER_PAGE'])
+    next_cursor = encode_cursor(last_key) if last_key else None
+    return render_template('all_posts.html', posts=posts, next_cursor=next_cursor)
+
+
+@app.before_first_request
+def setup_database():
+    upgrade_database()
+
+
+@app.route("/metrics")
+def metrics():
+    # per-stage timings of the NLP pipelines (of all processes, jobs included) in the Prometheus text format
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+@app.route("/charts/<kind>/<filename>")
+def chart(kind, filename):
+    # chart images are rendered in the background - this waits for the render if it hasn't finished yet
+    chart_file = get_chart_file(kind, filename)
+    if chart_file is None:
+        abort(404)
+    path, mimetype = chart_file
+    return send_artifact(path, mimetype=mimetype)
+
+
+@app.route("/artifacts/<directory>/<filename>")
+def artifact(directory, filename):
+    path = get_artifact_path(directory, filename)
+    if path is None:
+        abort(404)
+    if path.endswith('.gz') and not filename.endswith('.gz'):
+        return send_gzip_artifact(path, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    return send_artifact(path)
 
 
 @app.route("/about")
@@ -222,54 +316,107 @@ def user_upload():
 
     # validate form
     if form.validate_on_submit():
-        filename = save_text_file(form.text_file.data)
-        textfile = FileUpload(user_id=current_user.id, text_file=filename)
+        filename, content_hash, file_size = save_text_file(form.text_file.data)
+        textfile = FileUpload(user_id=current_user.id, text_file=filename, content_hash=content_hash,
+                              file_size=file_size)
         db.session.add(textfile)
         db.session.commit()
+        register_artifact('text_files', filename, current_user.id)
         flash('File uploaded!', 'success')
 
         return redirect(url_for('top_n_grams'))
     return render_template('upload.html', title='Upload Text File', form=form, legend='Upload File')
 
 
-@app.route("/top-n-grams", methods=['GET', 'POST'])
+@app.route("/uploads")
 @login_required
-def top_n_grams():
-    # fetch most recent filename from DB for current user
-    file_name = FileUpload.query.filter_by(user_id=current_user.id).all()[-1].text_file
+def upload_history():
+    # one page of the user's uploads, newest first - pass next_cursor back as ?cursor= for the next page
+    cursor = request.args.get('cursor')
+    after = decode_cursor(cursor) if cursor else None
+    if cursor and after is None:
+        abort(400)
+
+    uploads, last_key = FileUpload.get_history_page(current_user.id, after=after,
+                                                    per_page=app.config['UPLOADS_PER_PAGE'])
+    return jsonify(uploads=[{'id': upload.id,
+                             'text_file': upload.text_file,
+                             'content_hash': upload.content_hash,
+                             'file_size': upload.file_size,
+                             'date_posted': upload.date_posted.isoformat() if upload.date_posted else None}
+                            for upload in uploads],
+                   next_cursor=encode_cursor(last_key) if last_key else None)
 
-    # get contents of file
-    data = get_file_contents(file_name)
 
-    # convert data into data-frame
-    df_data = get_dataframe(data)
+@app.route("/top-n-grams", methods=['GET', 'POST'])
+@login_required
+def top_n_grams():
+    # fetch most recent upload from DB for current user
+    upload = FileUpload.get_latest(current_user.id)
+    if upload is None:
+        return redirect(url_for('user_upload'))
+    file_name = upload.text_file
+    if not os.path.exists(get_file_path(file_name)):
+        flash('Your last upload has expired, please upload it again.', 'info')
+        return redirect(url_for('user_upload'))
+    register_artifact('text_files', file_name, current_user.id)
+
+    if app.config['ANALYSIS_JOBS']:
+        # the analysis runs as a background job - the wait page shows the result once it has finished
+        job_id = submit_top_bigrams(upload)
+        return redirect(url_for('job_wait', job_id=job_id, view='top_n_grams_result'))
+
+    if os.path.getsize(get_file_path(file_name)) >= app.config['STREAM_UPLOAD_MIN_BYTES']:
+        # stream large files sentence by sentence instead of loading them at once
+        df_bigrams = get_top_bigrams_file(file_name, upload.content_hash)
+    else:
+        # get contents of file
+        data = get_file_contents(file_name)
+
+        # convert data into data-frame
+        df_data = get_dataframe(data)
+
+        # get top n bi-grams
+        df_bigrams = get_top_bigrams(df_data)
+
+    store_session_result('bigrams_upload', df_bigrams)
+    session.pop('top_bigrams_job_upload', None)  # results computed here are newer than any job
 
-    # get top n bi-grams
-    df_bigrams = get_top_bigrams(df_data)
+    return render_template('topics.html', title='Topics', data=df_bigrams)
 
-    session["df_bigrams_upload"] = df_bigrams.to_csv(index=False, header=True, sep=",")
 
+@app.route("/top-n-grams/result")
+@login_required
+def top_n_grams_result():
+    df_bigrams = use_top_bigrams_job('upload')
+    if df_bigrams is None:
+        return redirect(url_for('top_n_grams'))
     return render_template('topics.html', title='Topics', data=df_bigrams)
 
 
 @app.route("/download-bigrams-upload", methods=["POST"])
 @login_required
 def download_bigrams():
-    # Get the CSV data as a string from the session
-    csv = session["df_bigrams_upload"] if "df_bigrams_upload" in session else ""
+    df_bigrams = get_job_output('top_bigrams', 'upload', 'bigrams')
+    if df_bigrams is None:
+        return send_download(iter_session_result('bigrams_upload'), "bigrams")
 
-    return get_download_csv(file=csv, f_name="bigrams")
+    return send_download(iter_frame_chunks(df_bigrams), "bigrams")
 
 
-@app.route("/download-topics-upload", methods=["POST"])
+@app.route("/download-topics-upload", methods=["GET", "POST"])
 @login_required
 def download_topics():
-    dict_phrases = session["df_phrases"] if "df_phrases" in session else ""
-    df_phrases = pd.DataFrame(dict_phrases)
-    df_topics = get_main_topics(df_phrases)
-    csv = df_topics.to_csv(index=False, header=True, sep=",")
+    df_topics = get_job_output('topics', 'upload', 'topics')
+    if df_topics is None and app.config['ANALYSIS_JOBS']:
+        # the topic model is trained by a background job - the wait page comes back here once it has finished
+        job_id = submit_topics('upload')
+        return redirect(url_for('job_wait', job_id=job_id, view='download_topics'))
+    if df_topics is None:
+        df_phrases = load_session_result('phrases')
+        df_topics, vis_filename = get_main_topics(df_phrases, current_user.id)
 
-    return get_download_csv(file=csv, f_name="topics")
+    return send_download(iter_frame_chunks(df_topics), "topics")
 
 
 @app.route("/twitter-search", methods=['GET', 'POST'])
@@ -282,12 +429,8 @@ def twitter_search():
         df_tweets = get_tweets(text_query=str(form.text_query.data),
                                count=int(form.count.data))
 
-        # store raw tweets in session for later access
-        tweet_dict = df_tweets.to_dict('list')
-        session['tweet_dict'] = tweet_dict
-
-        # store raw tweets csv in session
-        session["df_tweets"] = df_tweets.to_csv(index=False, header=True, sep=",")
+        # store raw tweets for later access
+        store_session_result('tweets', df_tweets)
         num_records = len(df_tweets)
 
         # get min and max dates
@@ -297,26 +440,23 @@ def twitter_search():
         tweet_max_date = max(df_tweets['datetime']).date()
         session['tweet_max_date'] = tweet_max_date
 
-        # hashtag analysis
-        df_hashtag_count = get_hashtags(df_tweets)
+        # hashtag analysis and timeline
+        bucket = app.config['TWEET_TIMELINE_BUCKET']
+        df_hashtag_count, df_tweet_timeline = analyze_tweets(df_tweets, bucket)
 
-        # store hashtags in session
-        dict_hashtag_count = df_hashtag_count.to_dict('list')
-        session['dict_hashtag_count'] = dict_hashtag_count
+        # store hashtags for later access
+        store_session_result('hashtags', df_hashtag_count)
 
         # save barplot in session
         df_hashtag_count_20 = df_hashtag_count.head(20)
         df_hashtag_count_20 = df_hashtag_count_20.sort_values(by='count')
         barplot_fname = save_barplot(df_hashtag_count_20)
+        register_artifact('hashtags', barplot_fname, current_user.id)
         session['barplot_fname'] = barplot_fname
 
         # twitter timeline in session
-        df_tweet_timeline = df_tweets[['id', 'datetime']]
-        df_tweet_timeline['year_month'] = df_tweet_timeline['datetime'].apply(get_tweet_year_month)
-        print(df_tweet_timeline.head())
-        df_tweet_timeline = df_tweet_timeline.groupby(['year_month']).count().reset_index()[['year_month', 'id']]
-        print(df_tweet_timeline.head(5))
-        lineplot_fname = save_lineplot(df_tweet_timeline)
+        lineplot_fname = save_lineplot(df_tweet_timeline, get_timeline_axis_label(bucket))
+        register_artifact('twitter_timeline', lineplot_fname, current_user.id)
         session['lineplot_fname'] = lineplot_fname
 
         num_unique_words = session['num_unique_words'] if 'num_unique_words' in session else ""
@@ -332,27 +472,27 @@ def twitter_search():
 @app.route("/download-tweets", methods=["POST"])
 @login_required
 def download_tweets():
-    # Get the CSV data as a string from the session
-    csv = session["df_tweets"] if "df_tweets" in session else ""
-
-    return get_download_csv(file=csv, f_name="tweets")
+    # streamed from the result store chunk by chunk
+    return send_download(iter_session_result('tweets'), "tweets")
 
 
 @app.route("/get-top-bigrams", methods=["GET", "POST"])
 @login_required
 def get_top_bigrams_tweets():
-    # get raw tweets from session
-    tweet_dict = session['tweet_dict'] if 'tweet_dict' in session else ""
-    df_tweets = pd.DataFrame(tweet_dict)
+    if app.config['ANALYSIS_JOBS']:
+        # the analysis runs as a background job - the wait page shows the result once it has finished
+        job_id = submit_top_bigrams()
+        return redirect(url_for('job_wait', job_id=job_id, view='top_bigrams_tweets_result'))
 
-    df_tweets = df_tweets[['id', 'text']]
+    # get raw tweets - only the columns needed here
+    df_tweets = load_session_result('tweets', columns=['id', 'text'])
     df_tweets.columns = ['id', 'data']
     # get top-n-phrases
     df_bigrams = get_top_bigrams(df_tweets)
 
-    # save dict of top bigrams in session
-    dict_bigrams = df_bigrams.to_dict('list')
-    session['dict_bigrams'] = dict_bigrams
+    # save top bigrams for later access
+    store_session_result('bigrams_tweets', df_bigrams)
+    session.pop('top_bigrams_job_tweets', None)  # results computed here are newer than any job
 
     # get wordcloud from session
     wc_filename = session['wc_filename'] if 'wc_filename' in session else ""
@@ -361,61 +501,73 @@ def get_top_bigrams_tweets():
     return render_template('top_bigrams.html', title='Top bi-grams', wordcloud_fname=wc_filename)
 
 
+@app.route("/get-top-bigrams/result")
+@login_required
+def top_bigrams_tweets_result():
+    if use_top_bigrams_job('tweets') is None:
+        return redirect(url_for('get_top_bigrams_tweets'))
+    return render_template('top_bigrams.html', title='Top bi-grams', wordcloud_fname=session['wc_filename'])
+
+
 @app.route("/download-top-bigrams", methods=["GET", "POST"])
 @login_required
 def download_top_bigrams_tweets():
-    # get top bigrams from session
-    dict_bigrams = session['dict_bigrams'] if 'dict_bigrams' in session else ""
-    df_bigrams = pd.DataFrame(dict_bigrams)
-
-    csv = df_bigrams.to_csv(index=False, header=True, sep=",")
+    df_bigrams = get_job_output('top_bigrams', 'tweets', 'bigrams')
+    if df_bigrams is None:
+        return send_download(iter_session_result('bigrams_tweets'), "top-n-phrases")
 
-    return get_download_csv(file=csv, f_name="top-n-phrases")
+    return send_download(iter_frame_chunks(df_bigrams), "top-n-phrases")
 
 
 @app.route("/pyLDAVis", methods=["GET", "POST"])
 @login_required
 def get_topics_tweets():
-    # get phrases from session
-    dict_phrases = session["dict_phrases"] if "dict_phrases" in session else ""
-    df_phrases = pd.DataFrame(dict_phrases)
+    if app.config['ANALYSIS_JOBS']:
+        # the topic model is trained by a background job - the wait page shows it once it has finished
+        job_id = submit_topics('tweets')
+        return redirect(url_for('job_wait', job_id=job_id, view='topics_tweets_result'))
+
+    # get phrases
+    df_phrases = load_session_result('phrases')
 
     # get topic & viz
-    df_topics, vis_filename = get_main_topics(df_phrases)
-    dict_topics = df_topics.to_dict('list')
-    session['dict_topics'] = dict_topics
-    vis_path = os.path.join(app.root_path, 'static\lda_vis', vis_filename)
+    df_topics, vis_filename = get_main_topics(df_phrases, current_user.id)
+    store_session_result('topics_tweets', df_topics)
+    session.pop('topics_job_tweets', None)  # results computed here are newer than any job
 
-    with open(vis_path, 'r') as file:
-        data = file.read()
+    # the page is stored once per topic model and served (compressed, cacheable) from there
+    return redirect(url_for('artifact', directory='lda_vis', filename=vis_filename))
 
-    return "{}".format(data)
+
+@app.route("/pyLDAVis/result")
+@login_required
+def topics_tweets_result():
+    vis_filename = get_job_output('topics', 'tweets', 'vis_filename')
+    if vis_filename is None:
+        return redirect(url_for('get_topics_tweets'))
+    return redirect(url_for('artifact', directory='lda_vis', filename=vis_filename))
 
 
 @app.route("/download-topics-tweets", methods=["GET", "POST"])
 @login_required
 def download_topics_tweets():
-    dict_topics = session['dict_topics'] if 'dict_topics' in session else ""
-    df_topics = pd.DataFrame(dict_topics)
-    csv = df_topics.to_csv(index=False, header=True, sep=",")
+    df_topics = get_job_output('topics', 'tweets', 'topics')
+    if df_topics is None:
+        return send_download(iter_session_result('topics_tweets'), "topics")
 
-    return get_download_csv(file=csv, f_name="topics")
+    return send_download(iter_frame_chunks(df_topics), "topics")
 
 
 @app.route("/download_top-n-hashtags", methods=["GET", "POST"])
 @login_required
 def download_hashtags():
-    dict_hashtag_count = session['dict_hashtag_count'] if 'dict_hashtag_count' in session else ""
-    df_hashtag_count = pd.DataFrame(dict_hashtag_count)
-    csv = df_hashtag_count.to_csv(index=False, header=True, sep=",")
-
-    return get_download_csv(file=csv, f_name="top_hashtags")
+    return send_download(iter_session_result('hashtags'), "top_hashtags")
 
 
 @app.route("/tweet-analysis", methods=["GET", "POST"])
 @login_required
 def get_tweet_analysis_page():
-    num_records = len(pd.DataFrame(session['tweet_dict']))
+    num_records = count_session_result('tweets')
     print(num_records)
     search_query = session['text_query'] if 'text_query' in session else ""
     num_unique_words = session['num_unique_words'] if 'num_unique_words' in session else ""
@@ -428,3 +580,134 @@ def get_tweet_analysis_page():
                            search_query=search_query, num_words=num_unique_words,
                            barplot_fname=barplot_fname, lineplot_fname=lineplot_fname,
                            tweet_max_date=tweet_max_date, tweet_min_date=tweet_min_date)
+
+
+# ---------------------- BACKGROUND JOBS FOR THE NLP ANALYSES ---------------------- #
+
+
+def get_tweets_data():
+    """
+    Function to build the input data-frame for a job from the user's latest tweet search
+    """
+    df_tweets = load_session_result('tweets', columns=['id', 'text'])
+    if df_tweets.empty:
+        abort(400)
+    df_tweets.columns = ['id', 'data']
+    return df_tweets
+
+
+def get_source():
+    source = request.args.get('source', 'tweets')
+    if source not in ('tweets', 'upload'):
+        abort(400)
+    return source
+
+
+def submit_top_bigrams(upload=None):
+    """
+    Function to start a phrase job on the user's latest tweet search, or on an upload
+    Output: job id
+    """
+    if upload is not None:
+        # uploads are streamed from the file by the job itself
+        job_id = submit_job('top_bigrams_file', current_user.id, upload.text_file, current_user.id,
+                            upload.content_hash)
+        session['top_bigrams_job_upload'] = job_id
+    else:
+        job_id = submit_job('top_bigrams', current_user.id, get_tweets_data(), current_user.id)
+        session['top_bigrams_job_tweets'] = job_id
+    return job_id
+
+
+def submit_topics(source):
+    """
+    Function to start a topic model job on the phrases of the latest phrase job for a source, falling back to the
+    stored phrases
+    Output: job id
+    """
+    df_phrases = get_job_output('top_bigrams', source, 'phrases')
+    if df_phrases is None:
+        # upload jobs keep their phrases in the result store
+        phrases_id = get_job_output('top_bigrams', source, 'phrases_id')
+        df_phrases = load_result(current_user.id, phrases_id) if phrases_id else load_session_result('phrases')
+        if df_phrases.empty:
+            abort(400)
+
+    job_id = submit_job('topics', current_user.id, df_phrases, current_user.id)
+    session['topics_job_{}'.format(source)] = job_id
+    return job_id
+
+
+@app.route("/jobs/top-bigrams", methods=["POST"])
+@login_required
+def submit_top_bigrams_job():
+    upload = None
+    if get_source() == 'upload':
+        upload = FileUpload.get_latest(current_user.id)
+        if upload is None:
+            abort(400)
+        if not os.path.exists(get_file_path(upload.text_file)):
+            abort(410)  # the upload has expired
+        register_artifact('text_files', upload.text_file, current_user.id)
+    job_id = submit_top_bigrams(upload)
+
+    return jsonify(job_id=job_id, status_url=url_for('job_status', job_id=job_id)), 202
+
+
+@app.route("/jobs/topics", methods=["POST"])
+@login_required
+def submit_topics_job():
+    job_id = submit_topics(get_source())
+
+    return jsonify(job_id=job_id, status_url=url_for('job_status', job_id=job_id)), 202
+
+
+@app.route("/jobs/<job_id>/wait/<view>")
+@login_required
+def job_wait(job_id, view):
+    # page that reloads itself until the job has finished, then goes on to the page showing its result
+    if view not in JOB_RESULT_VIEWS:
+        abort(404)
+    status = get_job(job_id, current_user.id)
+    if status is None:
+        abort(404)
+    if status['status'] == DONE:
+        return redirect(url_for(view))
+    if status['status'] == FAILED:
+        flash('The analysis failed, please try again.', 'danger')
+        return redirect(url_for('home'))
+
+    return render_template('job_wait.html', title='Analyzing', refresh_seconds=app.config['JOB_POLL_SECONDS'])
+
+
+@app.route("/jobs/<job_id>")
+@login_required
+def job_status(job_id):
+    status = get_job(job_id, current_user.id)
+    if status is None:
+        abort(404)
+    if status['status'] == DONE:
+        status['result_url'] = url_for('job_result', job_id=job_id)
+
+    return jsonify(status)
+
+
+@app.route("/jobs/<job_id>/result")
+@login_required
+def job_result(job_id):
+    status = get_job(job_id, current_user.id)
+    if status is None:
+        abort(404)
+    if status['status'] != DONE:
+        return jsonify(status), 409  # result is not ready (or the job failed)
+
+    result = get_job_result(job_id, current_user.id)
+    if status['kind'] in ('top_bigrams', 'top_bigrams_file'):
+        if result.get('phrases_id') is not None:
+            # the stored phrases of an upload job become the user's current phrases
+            set_session_result('phrases', result['phrases_id'])
+        return jsonify(bigrams=result['bigrams'].to_dict('list'),
+                       wordcloud_url=url_for('chart', kind='wordclouds', filename=result['wc_filename']))
+
+    return jsonify(topics=result['topics'].to_dict('list'),
+                   vis_url=url_for('artifact', directory='lda_vis', filename=result['vis_filename']))
@@ -0,0 +1,86 @@
+"""
+Tests that the sharded phrase pipeline (NLP/shards.py) gives exactly the same phrases and n-gram counts as the
+single-process pipeline (cleanup_token_lists + get_phrases), both when it learns the phrase models and when it
+applies stored ones.
+
+Run from the directory above the repository, which must be checked out as a directory named flaskblog:
+    python -m pytest flaskblog/tests
+"""
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from flaskblog import app
+from flaskblog.NLP import shards, phrase_models, utils
+from flaskblog.NLP.utils import cleanup_token_lists, get_phrases, get_bigrams_and_words
+from flaskblog.NLP.token_corpus import TokenCorpus
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import corpus  # noqa: E402 - the synthetic corpora of the benchmarks
+
+NUM_SENTENCES = 3000
+SHARD_SENTENCES = 500
+# lower than the app's settings, so the small synthetic corpus has phrases to find
+PHRASES_MIN_COUNT = 5
+PHRASES_THRESHOLD = 1
+
+
+@pytest.fixture(autouse=True)
+def shard_setup(monkeypatch, tmp_path):
+    monkeypatch.setattr(phrase_models, 'PHRASE_MODELS_DIR', str(tmp_path))
+    monkeypatch.setattr(phrase_models, 'loaded_phrasers', {})
+    monkeypatch.setitem(app.config, 'SHARD_SENTENCES', SHARD_SENTENCES)
+    monkeypatch.setitem(app.config, 'PHRASE_UPDATE_MIN_BYTES', 1 << 40)  # no model updates during a test
+    for module in (utils, shards):
+        monkeypatch.setattr(module, 'PHRASES_MIN_COUNT', PHRASES_MIN_COUNT)
+        monkeypatch.setattr(module, 'PHRASES_THRESHOLD', PHRASES_THRESHOLD)
+
+    # the shards run on threads of this process, so they see the patched settings
+    executor = ThreadPoolExecutor(max_workers=4)
+    monkeypatch.setattr(shards, 'get_executor', lambda: executor)
+    yield
+    executor.shutdown()
+
+
+def run_single(sentences, scope):
+    phrased = get_phrases(TokenCorpus.from_token_lists(cleanup_token_lists(sentences)), scope)
+    return list(phrased.iter_texts()), get_bigrams_and_words(phrased, 300)
+
+
+def run_sharded(sentences, scope):
+    phrased, ngram_counts = shards.run_sharded_phrases(sentences, scope)
+    return list(phrased.iter_texts()), get_bigrams_and_words(phrased, 300, ngram_counts=ngram_counts)
+
+
+def test_learned_models_match_single_process():
+    sentences = corpus.make_sentences(NUM_SENTENCES, seed=1)
+    assert len(shards.get_shards(sentences)) > 1
+
+    single_phrases, single_ngrams = run_single(sentences, 'single')
+    sharded_phrases, sharded_ngrams = run_sharded(sentences, 'sharded')
+
+    assert any('_' in phrase for phrase in single_phrases)  # the corpus has phrases to find
+    assert sharded_phrases == single_phrases
+    assert sharded_ngrams == single_ngrams
+
+
+def test_stored_models_match_single_process():
+    run_single(corpus.make_sentences(NUM_SENTENCES, seed=1), 'global')
+    sentences = corpus.make_sentences(NUM_SENTENCES, seed=2)
+
+    assert run_sharded(sentences, 'global') == run_single(sentences, 'global')
+
+
+def test_stored_models_are_loaded_once_per_run(monkeypatch):
+    run_single(corpus.make_sentences(NUM_SENTENCES, seed=1), 'global')
+
+    # every shard is phrased with the generation loaded by the parent, even if a new one is published meanwhile
+    calls = []
+
+    def get_phrasers(scope):
+        calls.append(scope)
+        return phrase_models.get_phrasers(scope)
+
+    monkeypatch.setattr(shards, 'get_phrasers', get_phrasers)
+    shards.run_sharded_phrases(corpus.make_sentences(NUM_SENTENCES, seed=2), 'global')
+    assert calls == ['global']
@@ -1,20 +1,43 @@
 import os
 import secrets
 import pandas as pd
-import io
+import base64
+import hashlib
+import tempfile
+from datetime import datetime
 from flaskblog import app
+from flaskblog.NLP.sentences import sentence_pattern
 from PIL import Image
-from flask import send_file
 
 
 def save_text_file(form_text_file):
-    random_hex = secrets.token_hex(8)  # rename picture to random 8-bit hex value
+    """
+    Function to save an uploaded text file under the hash of its contents, so the same file is only stored once
+    :param form_text_file: file data from the form
+    :return: name of the stored file, sha256 of its contents, size in bytes
+    """
     _, f_ext = os.path.splitext(form_text_file.filename)  # obtain the file extension from form
-    text_filename = random_hex + f_ext  # create new filename
-    file_path = os.path.join(app.root_path, 'static/text_files', text_filename)  # set new relative path
-    form_text_file.save(dst=file_path, buffer_size=1024)
+    directory = os.path.join(app.root_path, 'static/text_files')
+
+    # copy the upload to a temporary file and hash it on the way
+    digest = hashlib.sha256()
+    file_size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as file:
+        for chunk in iter(lambda: form_text_file.stream.read(1024 * 1024), b''):
+            digest.update(chunk)
+            file.write(chunk)
+            file_size += len(chunk)
+
+    content_hash = digest.hexdigest()
+    text_filename = content_hash + f_ext.lower()  # create new filename
+    file_path = os.path.join(directory, text_filename)
+    if os.path.exists(file_path):
+        os.remove(tmp_path)  # same contents uploaded before
+    else:
+        os.replace(tmp_path, file_path)
 
-    return text_filename
+    return text_filename, content_hash, file_size
 
 
 def save_picture(form_picture, directory):
@@ -41,7 +64,7 @@ def save_picture(form_picture, directory):
 
 
 def get_file_contents(file_name):
-    file_location = os.path.join(app.root_path, 'static', 'text_files', file_name)
+    file_location = get_file_path(file_name)
 
     # open file and read its contents
     with open(file_location.__str__(), encoding="utf-8") as file:
@@ -50,23 +73,54 @@ def get_file_contents(file_name):
     return str(data)
 
 
+def get_file_path(file_name):
+    return os.path.join(app.root_path, 'static', 'text_files', file_name)
+
+
+def iter_file_sentences(file_name, chunk_size=1024 * 1024):
+    """
+    Function to read an uploaded file chunk by chunk and yield its sentences lazily
+    Splits exactly like get_file_contents + get_sentences, but only one chunk is held in memory at a time
+    Input: name of the uploaded file, number of characters read per chunk
+    Output: generator of sentences
+    """
+    carry = ''
+    with open(get_file_path(file_name), encoding="utf-8") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+
+            # the last piece may continue in the next chunk, so hold it back
+            sentences = sentence_pattern.split(carry + chunk.replace('\n', ' '))
+            carry = sentences.pop()
+            yield from sentences
+
+    yield carry
+
+
 def get_dataframe(data):
     df_test = pd.DataFrame([data], columns=['data'])
     return df_test
 
 
-def get_download_csv(file, f_name):
-
-    f_name = str(f_name)
-
-    # Create a string buffer
-    buf_str = io.StringIO(file)
+def encode_cursor(key):
+    """
+    Function to turn the (date_posted, id) key of a post into an opaque cursor for the URL
+    A post without a date gets an empty date part.
+    """
+    date_posted, post_id = key
+    raw = '{}|{}'.format(date_posted.isoformat() if date_posted is not None else '', post_id)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
 
-    # Create a bytes buffer from the string buffer
-    buf_byt = io.BytesIO(buf_str.read().encode("utf-8"))
 
-    # Return the CSV data as an attachment
-    return send_file(buf_byt,
-                     mimetype="text/csv",
-                     as_attachment=True,
-                     attachment_filename="{}.csv".format(f_name))
+def decode_cursor(cursor):
+    """
+    Function to get the (date_posted, id) key back from a cursor
+    Output: key, None if the cursor is invalid
+    """
+    try:
+        date_posted, post_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(date_posted) if date_posted else None, int(post_id)
+    except (ValueError, UnicodeError):
+        return None